@@ -0,0 +1,136 @@
+import math
+import time
+import typing
+import asyncio
+import fastapi
+import contextlib
+import collections
+
+
+# ==------------------------------------------------------------== #
+# Exceptions                                                       #
+# ==------------------------------------------------------------== #
+class OverloadError(Exception):
+    """Raised when query wasn't admitted to execution, because too many queries are executed and waiting."""
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def rejection_response(status_code: int, detail: str, retry_after: float | None = None) -> fastapi.Response:
+    """Builds fast rejection response with HTTP status code and optional `Retry-After` header."""
+
+    headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else None
+    return fastapi.responses.JSONResponse({"status": "Error", "detail": [detail]}, status_code=status_code, headers=headers)
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class TokenBucketLimiter:
+    """Per-client token buckets refilled with constant rate, every request takes one token.
+
+    Buckets of least recently seen clients are evicted when there are more than `max_clients` of them.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 65536) -> None:
+        """Stores limiter settings, zero `rate` disables limiting."""
+
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+
+        self.buckets = collections.OrderedDict()
+        self.rejected = 0
+
+    def allow(self, client: str) -> bool:
+        """Takes token from client bucket. Retrieves `False` if bucket is empty."""
+
+        # If rate limiting is disabled
+        if not self.rate:
+            return True
+
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(client, (self.burst, now))
+
+        # Refilling bucket by time passed since last request
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if allowed := tokens >= 1:
+            tokens -= 1
+
+        else:
+            self.rejected += 1
+
+        self.buckets[client] = (tokens, now)
+
+        # Evicting least recently seen clients
+        if len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+
+        return allowed
+
+    def retry_after(self, client: str) -> float:
+        """Retrieves time in seconds until client bucket contains one token."""
+
+        tokens, _ = self.buckets.get(client, (self.burst, None))
+        return max(0.0, (1 - tokens) / self.rate) if self.rate else 0.0
+
+
+class AdmissionController:
+    """Global cap of queries executed at the same time with bounded queue of waiting ones.
+
+    Queries, which can't be queued or waited too long, are rejected at once instead of piling up in pool.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float) -> None:
+        """Stores admission settings, zero `max_in_flight` disables the cap."""
+
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self.semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> typing.AsyncIterator[None]:
+        """Waits for free execution slot, raises `OverloadError` if waiting queue is full or slot wasn't freed in time."""
+
+        # If the cap is disabled
+        if self.semaphore is None:
+            yield
+            return
+
+        # If there is no free slot and no place in waiting queue
+        if self.semaphore.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise OverloadError("Too many queries are waiting for execution")
+
+        self.waiting += 1
+
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise OverloadError("Query waited for execution more than `%s` sec(s)" % self.queue_timeout)
+
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+
+        try:
+            yield
+
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def statistics(self) -> dict[str, int]:
+        """Retrieves admission counters."""
+
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "rejected": self.rejected}
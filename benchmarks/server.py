@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import math
+import time
+import toml
+import httpx
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+# Global and static variables, constants
+package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+startup_script = """
+CREATE TABLE IF NOT EXISTS Bench (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+default_workloads = "point_read=50,range_scan=20,write=20,script=5,large_result=5"
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def point_read(generator: random.Random, rows: int) -> dict:
+    """Builds request body reading one row by primary key."""
+
+    return {"query": "SELECT * FROM Bench WHERE id = ?;", "single": True, "params": [generator.randint(1, rows)]}
+
+
+def range_scan(generator: random.Random, rows: int) -> dict:
+    """Builds request body reading range of 100 rows by primary key."""
+
+    return {"query": "SELECT * FROM Bench WHERE id BETWEEN ? AND ? + 99;", "single": True, "params": [start := generator.randint(1, max(1, rows - 99)), start]}
+
+
+def write(generator: random.Random, rows: int) -> dict:
+    """Builds request body updating one row by primary key."""
+
+    return {"query": "UPDATE Bench SET value = ? WHERE id = ?;", "single": True, "params": [generator.randint(0, 1_000_000), generator.randint(1, rows)]}
+
+
+def script(generator: random.Random, rows: int) -> dict:
+    """Builds request body executing script of several updates in one transaction."""
+
+    updates = " ".join("UPDATE Bench SET value = value + 1 WHERE id = %s;" % generator.randint(1, rows) for _ in range(5))
+    return {"query": "BEGIN; %s COMMIT;" % updates, "single": False}
+
+
+def large_result(generator: random.Random, rows: int) -> dict:
+    """Builds request body reading large result set."""
+
+    return {"query": "SELECT * FROM Bench WHERE id > ? LIMIT 5000;", "single": True, "params": [generator.randint(0, max(0, rows - 5000))]}
+
+
+workload_builders = {
+    "point_read": point_read,
+    "range_scan": range_scan,
+    "write": write,
+    "script": script,
+    "large_result": large_result,
+}
+
+
+def parse_workloads(mix: str) -> dict[str, float]:
+    """Parses `name=weight` comma separated workloads mix."""
+
+    workloads = dict()
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition("=")
+
+        if name not in workload_builders:
+            raise SystemExit("Unknown workload `%s`, available: %s" % (name, ", ".join(workload_builders)))
+
+        workloads[name] = float(weight or 1)
+
+    return workloads
+
+
+def parse_override(override: str) -> tuple[str, str, object]:
+    """Parses `section.key=value` config override, value is parsed as TOML value or kept as string."""
+
+    path, _, value = override.partition("=")
+    section, _, key = path.partition(".")
+
+    try:
+        value = toml.loads("value = %s" % value)["value"]
+
+    except toml.TomlDecodeError:
+        pass
+
+    return section, key, value
+
+
+def free_port() -> int:
+    """Retrieves free local TCP port."""
+
+    with socket.socket() as server_socket:
+        server_socket.bind(("127.0.0.1", 0))
+        return server_socket.getsockname()[1]
+
+
+def percentile(values: list[float], part: float) -> float:
+    """Retrieves nearest-rank percentile of sorted values."""
+
+    return values[min(len(values) - 1, max(0, math.ceil(part * len(values)) - 1))] if values else 0.0
+
+
+def summarize(latencies: list[float], errors: int, duration: float) -> dict:
+    """Retrieves requests count, rate and latency percentiles in milliseconds."""
+
+    latencies = sorted(latencies)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / duration, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def start_server(directory: str, port: int, overrides: list[str]) -> subprocess.Popen:
+    """Writes config and startup script to temporary directory and starts the server there."""
+
+    config = toml.load(os.path.join(package_path, "config.toml"))
+    config["database"] |= {"host": "127.0.0.1", "port": port, "file_path": "bench.db", "allowed_passwords": list(), "allowed_ips": list()}
+
+    for override in overrides:
+        section, key, value = parse_override(override)
+        config.setdefault(section, dict())[key] = value
+
+    with open(os.path.join(directory, "config.toml"), "w", encoding="utf-8") as file:
+        toml.dump(config, file)
+
+    with open(os.path.join(directory, "startup.sql"), "w", encoding="utf-8") as file:
+        file.write(startup_script)
+
+    return subprocess.Popen([sys.executable, os.path.join(package_path, "main.py")], cwd=directory, stdout=open(os.path.join(directory, "server.log"), "w"), stderr=subprocess.STDOUT)
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Prints changes of requests rate and tail latency against baseline report."""
+
+    for name, result in report["workloads"].items():
+        if (previous := baseline["workloads"].get(name)) is None:
+            continue
+
+        rps_change = (result["rps"] / previous["rps"] - 1) * 100 if previous["rps"] else 0.0
+        p99_change = (result["p99_ms"] / previous["p99_ms"] - 1) * 100 if previous["p99_ms"] else 0.0
+
+        print(f"{name:<14} rps {previous['rps']:>10.2f} -> {result['rps']:>10.2f} ({rps_change:+.1f}%)   p99 {previous['p99_ms']:>9.3f} -> {result['p99_ms']:>9.3f} ms ({p99_change:+.1f}%)")
+
+
+# ==------------------------------------------------------------== #
+# Async functions                                                  #
+# ==------------------------------------------------------------== #
+async def wait_for_server(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    """Waits until server accepts requests."""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+
+        if process.poll() is not None:
+            raise SystemExit("Server exited with code `%s`" % process.returncode)
+
+        try:
+            await client.post(url + "/stats", json=dict())
+            return
+
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+
+    raise SystemExit("Server didn't start in `%s` sec(s)" % timeout)
+
+
+async def seed(client: httpx.AsyncClient, url: str, rows: int, generator: random.Random) -> None:
+    """Inserts benchmark rows using bulk insert route."""
+
+    for start in range(0, rows, 10000):
+        chunk = [[f"name-{index}", generator.randint(0, 1_000_000), "x" * 64] for index in range(start, min(rows, start + 10000))]
+        response = (await client.post(url + "/bulk", json={"query": "INSERT INTO Bench (name, value, payload) VALUES (?, ?, ?);", "rows": chunk})).json()
+
+        if response["status"] != "OK":
+            raise SystemExit("Unable to seed database: %s" % response["detail"])
+
+
+async def run_worker(client: httpx.AsyncClient, url: str, workloads: dict[str, float], rows: int, generator: random.Random, deadline: float, results: dict[str, list]) -> None:
+    """Sends requests of randomly chosen workloads one by one until deadline."""
+
+    names, weights = list(workloads), list(workloads.values())
+    while time.monotonic() < deadline:
+        name = generator.choices(names, weights)[0]
+        body = workload_builders[name](generator, rows)
+
+        start_time = time.perf_counter()
+
+        try:
+            response = await client.post(url, json=body)
+            ok = response.status_code == 200 and response.json()["status"] == "OK"
+
+        except httpx.HTTPError:
+            ok = False
+
+        latency = time.perf_counter() - start_time
+
+        # Only successful requests are counted in latency percentiles
+        if ok:
+            results[name][0].append(latency)
+
+        else:
+            results[name][1] += 1
+
+
+async def benchmark(arguments: argparse.Namespace) -> dict:
+    """Starts the server in temporary directory, seeds it, runs workloads and retrieves report."""
+
+    workloads = parse_workloads(arguments.workloads)
+    generator = random.Random(arguments.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        port = arguments.port or free_port()
+        process = start_server(directory, port, arguments.set)
+
+        url = "http://127.0.0.1:%s%s" % (port, toml.load(os.path.join(directory, "config.toml"))["database"]["route"])
+        limits = httpx.Limits(max_connections=arguments.concurrency, max_keepalive_connections=arguments.concurrency)
+
+        try:
+
+            async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+                await wait_for_server(client, url, process)
+                await seed(client, url, arguments.rows, generator)
+
+                # Warming up connections and caches, results are dropped
+                warmup_results = {name: [list(), 0] for name in workloads}
+                await asyncio.gather(*[run_worker(client, url, workloads, arguments.rows, random.Random(generator.random()), time.monotonic() + arguments.warmup, warmup_results) for _ in range(arguments.concurrency)])
+
+                results = {name: [list(), 0] for name in workloads}
+                start_time = time.monotonic()
+                await asyncio.gather(*[run_worker(client, url, workloads, arguments.rows, random.Random(generator.random()), start_time + arguments.duration, results) for _ in range(arguments.concurrency)])
+                duration = time.monotonic() - start_time
+
+        finally:
+            process.terminate()
+            process.wait(10)
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "python": sys.version.split()[0],
+        "settings": {"workloads": workloads, "concurrency": arguments.concurrency, "duration": arguments.duration, "warmup": arguments.warmup, "rows": arguments.rows, "seed": arguments.seed, "overrides": arguments.set},
+        "duration_secs": round(duration, 3),
+        "total": summarize([latency for latencies, _ in results.values() for latency in latencies], sum(errors for _, errors in results.values()), duration),
+        "workloads": {name: summarize(latencies, errors, duration) for name, (latencies, errors) in results.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Starts the server on temporary database and measures throughput and latency of workloads mix.")
+    parser.add_argument("--workloads", default=default_workloads, help="Comma separated `name=weight` mix of %s" % ", ".join(workload_builders))
+    parser.add_argument("--concurrency", type=int, default=16, help="Count of clients sending requests at the same time")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measurement time in seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Warm up time in seconds, not measured")
+    parser.add_argument("--rows", type=int, default=100000, help="Count of rows seeded into benchmark table")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of generated requests")
+    parser.add_argument("--port", type=int, default=0, help="Server port, free one is chosen by default")
+    parser.add_argument("--set", action="append", default=list(), metavar="SECTION.KEY=VALUE", help="Server config override, for example `pool.wal=true`")
+    parser.add_argument("--output", help="Path of JSON report, printed to stdout by default")
+    parser.add_argument("--compare", help="Path of baseline JSON report to compare with")
+    arguments = parser.parse_args()
+
+    report = asyncio.run(benchmark(arguments))
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+
+    else:
+        print(json.dumps(report, indent=4))
+
+    if arguments.compare:
+        with open(arguments.compare, "r", encoding="utf-8") as file:
+            compare(report, json.load(file))
@@ -0,0 +1,76 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+
+# Local imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlfunctions
+
+# Global and static variables, constants
+queries = {
+    "regexp": ("SELECT COUNT(*) FROM Bench WHERE name REGEXP ?;", [r"name-\d*7$"]),
+    "time_difference": ("SELECT SUM(TIME_DIFFERENCE(created, ?)) FROM Bench;", ["2024-01-01 00:00:00"]),
+}
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def uncached_regexp(pattern: str, string: str) -> bool:
+    """Checks if string matches regex pattern, looking pattern up in `re` module cache, as before."""
+
+    return re.match(pattern, string) is not None
+
+
+def uncached_time_difference(stop_timestamp: str, start_timestamp: str) -> int:
+    """Retrieves time difference between two time stamps parsing both of them, as before."""
+
+    return int(time.mktime(datetime.datetime.strptime(stop_timestamp, r"%Y-%m-%d %H:%M:%S").timetuple())) - int(time.mktime(datetime.datetime.strptime(start_timestamp, r"%Y-%m-%d %H:%M:%S").timetuple()))
+
+
+def create_database(rows: int) -> sqlite3.Connection:
+    """Creates in-memory table with names and creation time stamps, repeated every hour."""
+
+    database = sqlite3.connect(":memory:")
+    database.execute("CREATE TABLE Bench (id INTEGER PRIMARY KEY, name TEXT NOT NULL, created TEXT NOT NULL);")
+    database.executemany("INSERT INTO Bench (name, created) VALUES (?, ?);", ((f"name-{index}", sqlfunctions.timestamp_from_unix(1700000000 + index % 3600)) for index in range(rows)))
+
+    return database
+
+
+def measure(database: sqlite3.Connection, query: str, params: list, iterations: int) -> tuple[float, object]:
+    """Measures mean query execution time and retrieves its result."""
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        result = database.execute(query, params).fetchone()[0]
+
+    return (time.perf_counter() - start_time) / iterations, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares per query cost of user defined functions before and after memoization of patterns and time stamps.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=5)
+    arguments = parser.parse_args()
+
+    database = create_database(arguments.rows)
+
+    for name, (query, params) in queries.items():
+        database.create_function("REGEXP", 2, uncached_regexp)
+        database.create_function("TIME_DIFFERENCE", 2, uncached_time_difference)
+        uncached_time, uncached_result = measure(database, query, params, arguments.iterations)
+
+        database.create_function("REGEXP", 2, sqlfunctions.regexp, deterministic=True)
+        database.create_function("TIME_DIFFERENCE", 2, sqlfunctions.time_difference)
+        cached_time, cached_result = measure(database, query, params, arguments.iterations)
+
+        # Both functions have to retrieve the same result
+        assert uncached_result == cached_result
+
+        print(f"{name:<16} uncached: {uncached_time * 1e3:9.2f} ms   cached: {cached_time * 1e3:9.2f} ms   speedup: {uncached_time / cached_time:.1f}x")
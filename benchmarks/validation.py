@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+# Local imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import *
+
+# Global and static variables, constants
+required_params = ["password", "query", "single", "params", "stream", "stream_format", "format", "layout"]
+params_limitations = [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    (None, list(), bool),
+    (None, list(), (list, dict)),
+    (None, list(), bool),
+    (None, ["ndjson", "json"], str),
+    (None, ["json", "msgpack"], str),
+    (None, ["rows", "columns"], str),
+]
+optional_params = ["params", "stream", "stream_format", "format", "layout"]
+
+bodies = {
+    "valid": {"password": "pass", "query": "SELECT * FROM Users WHERE login = ?;", "single": True, "params": ["FirstUser"], "format": "json"},
+    "invalid": {"query": 42, "single": "yes", "stream_format": "xml"},
+}
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def measure_compiled(body: dict, iterations: int) -> float:
+    """Measures per request cost of precompiled schema validation."""
+
+    schema = ParamsSchema(required_params, params_limitations, optional_params)
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        schema.validate(body)
+
+    return (time.perf_counter() - start_time) / iterations
+
+
+# ==------------------------------------------------------------== #
+# Async functions                                                  #
+# ==------------------------------------------------------------== #
+async def measure_legacy(body: dict, iterations: int) -> float:
+    """Measures per request cost of building limitations and awaiting `validate_params`, as handlers did before."""
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        await validate_params(body, list(required_params), list(params_limitations), list(optional_params))
+
+    return (time.perf_counter() - start_time) / iterations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares per request cost of `validate_params` and precompiled `ParamsSchema`.")
+    parser.add_argument("--iterations", type=int, default=100000)
+    arguments = parser.parse_args()
+
+    for name, body in bodies.items():
+        schema = ParamsSchema(required_params, params_limitations, optional_params)
+
+        # Both validators have to report the same errors
+        assert schema.validate(body) == asyncio.run(validate_params(body, required_params, params_limitations, optional_params))
+
+        legacy_time = asyncio.run(measure_legacy(body, arguments.iterations))
+        compiled_time = measure_compiled(body, arguments.iterations)
+
+        print(f"{name:<8} validate_params: {legacy_time * 1e6:8.2f} us   ParamsSchema.validate: {compiled_time * 1e6:8.2f} us   speedup: {legacy_time / compiled_time:.1f}x")
@@ -0,0 +1,210 @@
+import re
+import json
+import time
+import typing
+import asyncio
+import aiosqlite
+import functools
+import collections
+
+# Local imports
+from misc import *
+
+# Global and static variables, constants
+normalization_pattern = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+token_pattern = re.compile(r"('(?:[^']|'')*')|\"(?:[^\"]|\"\")*\"|\b([A-Za-z_]\w*)\b(\s*\(\s*\)|\s*\()?")
+
+# Built-in functions and keywords, which results don't depend only on arguments and database content
+nondeterministic_builtin_functions = frozenset(["RANDOM", "RANDOMBLOB", "CHANGES", "TOTAL_CHANGES", "LAST_INSERT_ROWID"])
+time_builtin_functions = frozenset(["DATE", "TIME", "DATETIME", "JULIANDAY", "STRFTIME", "UNIXEPOCH", "TIMEDIFF"])
+time_keywords = frozenset(["CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP"])
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def normalize_query(query: str) -> str:
+    """Collapses whitespaces of SQL query outside of string literals and identifiers."""
+
+    return normalization_pattern.sub(lambda match: match.group(1) or " ", query).strip().rstrip(";").rstrip()
+
+
+@functools.lru_cache(maxsize=4096)
+def is_deterministic(query: str, nondeterministic_functions: frozenset[str] = frozenset()) -> bool:
+    """Checks if SQL query doesn't call non-deterministic built-in or given functions, time functions are non-deterministic with `'now'` or without arguments."""
+
+    calls_time_function = has_now_literal = False
+    for match in token_pattern.finditer(query):
+
+        # If token is string literal
+        if match.group(1) is not None:
+            has_now_literal = has_now_literal or match.group(1)[1:-1].lower() == "now"
+            continue
+
+        # If token is identifier or keyword, which isn't called
+        if (name := (match.group(2) or "").upper()) in time_keywords:
+            return False
+
+        if not match.group(3):
+            continue
+
+        if name in nondeterministic_builtin_functions or name in nondeterministic_functions:
+            return False
+
+        # Time functions without arguments retrieve current time
+        if name in time_builtin_functions:
+
+            if match.group(3).rstrip().endswith(")"):
+                return False
+
+            calls_time_function = True
+
+    return not (calls_time_function and has_now_literal)
+
+
+def estimate_size(columns: list[str], data: list[tuple]) -> int:
+    """Roughly estimates memory used by query result."""
+
+    return sum(len(column) for column in columns) + sum(64 + sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row) for row in data)
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class ResultCache:
+    """In-process LRU cache of read-only queries results with TTL and memory limit.
+
+    Entries are invalidated by writes made through the server to the tables they read,
+    optionally the whole cache is dropped when `PRAGMA data_version` reports external changes.
+    """
+
+    def __init__(self, ttl: float, max_size: int, nondeterministic_functions: list[str] | None = None) -> None:
+        """Stores cache settings, results of queries calling given SQL functions aren't cached."""
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self.nondeterministic_functions = frozenset(name.upper() for name in nondeterministic_functions or list())
+
+        self.entries = collections.OrderedDict()
+        self.tables_keys = collections.defaultdict(set)
+        self.size = 0
+
+        # Incremented on every invalidation, results read before it are not cached
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, query: str) -> bool:
+        """Checks if result of read-only query can be cached, results of non-deterministic functions are always fresh."""
+
+        return is_deterministic(query, self.nondeterministic_functions)
+
+    def key(self, query: str, params: list | dict) -> tuple[str, str]:
+        """Builds cache key from normalized query and its params."""
+
+        return normalize_query(query), json.dumps(params, sort_keys=True)
+
+    def get(self, key: tuple[str, str]) -> dict[str, typing.Any] | None:
+        """Retrieves cached result if it's not expired."""
+
+        # If result wasn't cached or already expired
+        if (entry := self.entries.get(key)) is None or entry[0] < time.monotonic():
+
+            if entry is not None:
+                self.remove(key)
+
+            self.misses += 1
+            return
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return entry[3]
+
+    def put(self, key: tuple[str, str], result: dict[str, typing.Any], tables: frozenset[str], generation: int) -> None:
+        """Caches result of query read from given tables, evicts least recently used results to fit in memory limit."""
+
+        # If some tables were changed while query was executed or result is too big
+        if generation != self.generation or (size := estimate_size(result["columns"], result["data"])) > self.max_size:
+            return
+
+        if key in self.entries:
+            self.remove(key)
+
+        self.entries[key] = (time.monotonic() + self.ttl, size, tables, result)
+        self.size += size
+
+        for table in tables:
+            self.tables_keys[table.lower()].add(key)
+
+        # Evicting least recently used results
+        while self.size > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key: tuple[str, str]) -> None:
+        """Removes result from cache."""
+
+        _, size, tables, _ = self.entries.pop(key)
+        self.size -= size
+
+        for table in tables:
+            self.tables_keys[table.lower()].discard(key)
+
+    def invalidate(self, tables: tuple[frozenset[str], frozenset[str], bool] | None) -> None:
+        """Removes results read from written tables. Clears whole cache if written tables are unknown or schema was changed."""
+
+        self.generation += 1
+
+        # If written tables are unknown or schema was changed
+        if tables is None or tables[2]:
+            return self.clear()
+
+        for table in tables[1]:
+            for key in list(self.tables_keys.pop(table.lower(), set())):
+                self.remove(key)
+
+    def clear(self) -> None:
+        """Removes all of the cached results."""
+
+        self.generation += 1
+
+        self.entries.clear()
+        self.tables_keys.clear()
+        self.size = 0
+
+    def statistics(self) -> dict[str, int | float]:
+        """Retrieves cache usage counters."""
+
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else 0.0,
+        }
+
+    async def watch_data_version(self, database_path: str, interval: float) -> None:
+        """Clears cache every time database was changed by any other connection, including writes made outside of the server."""
+
+        async with aiosqlite.connect(f"file:{database_path}?mode=ro", uri=True) as database:
+
+            data_version = None
+            while True:
+
+                try:
+
+                    async with database.execute("PRAGMA data_version;") as cursor:
+                        current_data_version = (await cursor.fetchone())[0]
+
+                    # If database was changed since last check
+                    if data_version is not None and current_data_version != data_version:
+                        self.clear()
+
+                    data_version = current_data_version
+
+                # Transient errors, like locked database, are retried on next check
+                except aiosqlite.Error as error:
+                    await log(rf"%magenta[%now] %redERROR%reset:{' '}Unable to read database data version: {error}", level="ERROR")
+
+                await asyncio.sleep(interval)
@@ -0,0 +1,329 @@
+import json
+import time
+import typing
+import asyncio
+import aiosqlite
+
+# Local imports
+from pool import *
+
+# Global and static variables, constants
+changes_table = "DatabaseChanges"
+changes_operations = {"insert": "NEW", "update": "NEW", "delete": "OLD"}
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def quote_identifier(name: str) -> str:
+    """Quotes SQL identifier."""
+
+    return '"%s"' % name.replace('"', '""')
+
+
+def changes_trigger_name(table: str, operation: str) -> str:
+    """Retrieves name of trigger capturing operation on table."""
+
+    return f"{changes_table}_{table}_{operation}"
+
+
+def changes_statements(tables: list[str]) -> list[str]:
+    """Builds statements creating changes table and triggers recording changed rows of given tables into it."""
+
+    # Identifiers are increasing even after all of the changes were pruned
+    statements = [
+        'CREATE TABLE IF NOT EXISTS %s ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "table" TEXT NOT NULL, "operation" TEXT NOT NULL, "row_id" INTEGER, '
+        '"time" REAL NOT NULL DEFAULT (julianday(\'now\')));' % quote_identifier(changes_table),
+    ]
+
+    for table in tables:
+        for operation, row in changes_operations.items():
+            statements.append('CREATE TRIGGER IF NOT EXISTS %s AFTER %s ON %s BEGIN INSERT INTO %s ("table", "operation", "row_id") VALUES (%s, \'%s\', %s.rowid); END;' % (
+                quote_identifier(changes_trigger_name(table, operation)),
+                operation.upper(),
+                quote_identifier(table),
+                quote_identifier(changes_table),
+                "'%s'" % table.replace("'", "''"),
+                operation,
+                row,
+            ))
+
+    return statements
+
+
+async def drop_changes_triggers(database: aiosqlite.Connection, tables: list[str]) -> list[str]:
+    """Drops triggers capturing changes of tables except given ones. Retrieves names of dropped triggers."""
+
+    kept_triggers = {changes_trigger_name(table, operation).lower() for table in tables for operation in changes_operations}
+
+    async with database.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'trigger';") as cursor:
+        triggers = await cursor.fetchall()
+
+    # Triggers of change feed are recognized by their names, identifiers are case insensitive
+    dropped_triggers = [
+        name for name, table in triggers
+        if name.lower() not in kept_triggers and name.lower() in {changes_trigger_name(table, operation).lower() for operation in changes_operations}
+    ]
+
+    for name in dropped_triggers:
+        await database.execute("DROP TRIGGER IF EXISTS %s;" % quote_identifier(name))
+
+    return dropped_triggers
+
+
+async def remove_changes(database: aiosqlite.Connection) -> None:
+    """Drops all triggers of change feed and deletes captured changes, identifiers of changes aren't reused after that."""
+
+    await drop_changes_triggers(database, list())
+
+    async with database.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", [changes_table]) as cursor:
+        exists = await cursor.fetchone() is not None
+
+    if exists:
+        await database.execute("DELETE FROM %s;" % quote_identifier(changes_table))
+
+    await database.commit()
+
+
+def coalesce_changes(rows: list[tuple[int, str, str, int]], max_rowids: int) -> dict[str, dict[str, typing.Any]]:
+    """Groups changed rows by table and operation dropping repeated rowids, too long rowids lists are replaced by `truncated` flag."""
+
+    changes = dict()
+    for _, table, operation, row_id in rows:
+        changes.setdefault(table, dict()).setdefault(operation, dict())[row_id] = None
+
+    for table, operations in changes.items():
+        for operation, rowids in list(operations.items()):
+
+            # If table was changed too much, client have to reread it
+            if len(rowids) > max_rowids:
+                operations[operation] = None
+                operations["truncated"] = True
+
+            else:
+                operations[operation] = list(rowids)
+
+    return changes
+
+
+def format_event(event: str, data: dict[str, typing.Any], event_id: int | None = None) -> bytes:
+    """Formats server-sent event."""
+
+    return (("id: %s\n" % event_id if event_id is not None else "") + "event: %s\ndata: %s\n\n" % (event, json.dumps(data, separators=(",", ":")))).encode()
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class Subscription:
+    """Queue of changes notifications of one client, overflowed queue is dropped and client is notified to reread tables."""
+
+    def __init__(self, tables: set[str] | None, queue_size: int, start_id: int) -> None:
+        """Creates empty notifications queue, `None` tables means all of the captured ones.
+
+        Changes after `start_id` identifier are queued, previous ones can only be replayed.
+        """
+
+        self.tables = tables
+        self.start_id = start_id
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def select(self, changes: dict[str, dict[str, typing.Any]]) -> dict[str, dict[str, typing.Any]]:
+        """Retrieves changes of subscribed tables."""
+
+        return {table: operations for table, operations in changes.items() if self.tables is None or table in self.tables}
+
+    def push(self, change_id: int, changes: dict[str, dict[str, typing.Any]]) -> None:
+        """Queues changes of subscribed tables."""
+
+        # If client didn't subscribe to changed tables or it didn't receive overflow notification yet
+        if not (changes := self.select(changes)) or self.overflowed:
+            return
+
+        try:
+            self.queue.put_nowait((change_id, changes))
+
+        # Dropping queued changes, client have to reread subscribed tables
+        except asyncio.QueueFull:
+
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+            self.queue.put_nowait((None, None))
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> tuple[int | None, dict[str, dict[str, typing.Any]] | None] | None:
+        """Waits for next changes up to `timeout` seconds. Retrieves `None` if there are no changes yet and `(None, None)` on overflow."""
+
+        try:
+            change_id, changes = await asyncio.wait_for(self.queue.get(), timeout)
+
+        except asyncio.TimeoutError:
+            return
+
+        # If queue was overflowed, next changes are queued again
+        if change_id is None:
+            self.overflowed = False
+
+        return change_id, changes
+
+
+class ChangeFeed:
+    """Changes of tables captured by triggers into changes table and pushed to subscribers.
+
+    Changes table is checked when `PRAGMA data_version` reports commits of any connection, including another processes,
+    changes committed during `interval` are coalesced into one notification. Rolled back changes are never notified.
+    """
+
+    def __init__(self, pool: ConnectionPool, tables: list[str], interval: float, max_rowids: int, retention: float, queue_size: int, fetch_size: int = 10000) -> None:
+        """Stores change feed settings, watching is started with `watch` method."""
+
+        self.pool = pool
+        self.tables = tables
+        self.interval = interval
+        self.max_rowids = max_rowids
+        self.retention = retention
+        self.queue_size = queue_size
+        self.fetch_size = fetch_size
+
+        self.subscriptions = set()
+        self.database = None
+        self.last_id = 0
+
+    async def prepare(self) -> list[str]:
+        """Creates changes table and triggers of captured tables, drops triggers of another tables. Retrieves tables, which changes can't be captured."""
+
+        async with self.pool.acquire() as (database, _):
+            tables, skipped_tables = list(), list()
+
+            for table in self.tables:
+
+                # Triggers record rowids, so table have to exist and have rowid
+                try:
+                    await database.execute("SELECT rowid FROM %s LIMIT 0;" % quote_identifier(table))
+                    tables.append(table)
+
+                except aiosqlite.OperationalError:
+                    skipped_tables.append(table)
+
+            # Triggers of tables, which aren't captured anymore, would fill changes table forever
+            await drop_changes_triggers(database, tables)
+
+            for statement in changes_statements(tables):
+                await database.execute(statement)
+
+            # Deleting changes kept since previous run
+            await database.execute('DELETE FROM %s WHERE "time" < julianday(\'now\') - ?;' % quote_identifier(changes_table), [self.retention / 86400])
+            await database.commit()
+
+        self.tables = tables
+        return skipped_tables
+
+    def subscribe(self, tables: set[str] | None = None) -> Subscription:
+        """Creates subscription to changes of given tables."""
+
+        self.subscriptions.add(subscription := Subscription(tables, self.queue_size, self.last_id))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Removes subscription."""
+
+        self.subscriptions.discard(subscription)
+
+    async def read(self, since: int, until: int | None = None) -> list[tuple[int, str, str, int]]:
+        """Retrieves captured changes after `since` identifier up to `until` one, fetching them by `fetch_size` rows."""
+
+        rows = list()
+        while True:
+
+            query = 'SELECT "id", "table", "operation", "row_id" FROM %s WHERE "id" > ? AND "id" <= ? ORDER BY "id" LIMIT ?;' % quote_identifier(changes_table)
+            params = [rows[-1][0] if rows else since, until if until is not None else 2 ** 63 - 1, self.fetch_size]
+
+            async with self.database.execute(query, params) as cursor:
+                rows.extend(batch := await cursor.fetchall())
+
+            if len(batch) < self.fetch_size:
+                return rows
+
+    async def replay(self, since: int, until: int) -> tuple[bool, dict[str, dict[str, typing.Any]]]:
+        """Retrieves coalesced changes after `since` identifier up to `until` one and whether all of them are still kept."""
+
+        async with self.database.execute('SELECT min("id") FROM %s;' % quote_identifier(changes_table)) as cursor:
+            first_id = (await cursor.fetchone())[0]
+
+        # If some of the changes were already deleted
+        if (first_id is None and since < until) or (first_id is not None and first_id > since + 1):
+            return False, dict()
+
+        return True, coalesce_changes(await self.read(since, until), self.max_rowids)
+
+    def publish(self, rows: list[tuple[int, str, str, int]]) -> None:
+        """Pushes coalesced changes to all subscribers."""
+
+        changes = coalesce_changes(rows, self.max_rowids)
+        for subscription in list(self.subscriptions):
+            subscription.push(rows[-1][0], changes)
+
+    async def prune(self) -> None:
+        """Deletes changes older than `retention` seconds."""
+
+        async with self.pool.acquire() as (database, _):
+            await database.execute('DELETE FROM %s WHERE "time" < julianday(\'now\') - ?;' % quote_identifier(changes_table), [self.retention / 86400])
+            await database.commit()
+
+    async def watch(self) -> None:
+        """Pushes new changes every time database was changed, periodically deletes old changes."""
+
+        self.database = await aiosqlite.connect(f"file:{self.pool.database_path}?mode=ro", uri=True)
+
+        try:
+
+            # Only tables having triggers are captured, database is prepared by parent process in multi-process mode
+            async with self.database.execute("SELECT name FROM sqlite_master WHERE type = 'trigger';") as cursor:
+                triggers = {name.lower() for name, in await cursor.fetchall()}
+
+            self.tables = [table for table in self.tables if all(changes_trigger_name(table, operation).lower() in triggers for operation in changes_operations)]
+
+            # Changes made before start aren't notified
+            async with self.database.execute('SELECT coalesce(max("id"), 0) FROM %s;' % quote_identifier(changes_table)) as cursor:
+                self.last_id = (await cursor.fetchone())[0]
+
+            data_version = None
+            prune_time = time.monotonic() + self.retention / 2
+
+            while True:
+
+                try:
+
+                    async with self.database.execute("PRAGMA data_version;") as cursor:
+                        current_data_version = (await cursor.fetchone())[0]
+
+                    # If database was changed since last check, changes of all commits are sent at once
+                    if current_data_version != data_version:
+
+                        # Last identifier is updated together with publishing, so replayed changes aren't sent twice
+                        if rows := await self.read(self.last_id):
+                            self.last_id = rows[-1][0]
+                            self.publish(rows)
+
+                        data_version = current_data_version
+
+                # Transient errors, like locked database, are retried on next check
+                except aiosqlite.Error as error:
+                    await log(rf"%magenta[%now] %redERROR%reset:{' '}Unable to read changes of tables: {error}", level="ERROR")
+
+                # Deleting changes, which were sent long ago
+                if time.monotonic() >= prune_time:
+                    prune_time = time.monotonic() + self.retention / 2
+
+                    try:
+                        await self.prune()
+
+                    except (aiosqlite.Error, PoolTimeoutError) as error:
+                        await log(rf"%magenta[%now] %yellowWARN%reset:{' ' * 2}Unable to delete old changes: {error}", level="WARN")
+
+                await asyncio.sleep(self.interval)
+
+        finally:
+            await self.database.close()
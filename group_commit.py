@@ -0,0 +1,181 @@
+import time
+import asyncio
+import aiosqlite
+import contextlib
+
+# Local imports
+from pool import *
+from cache import *
+
+# Global and static variables, constants
+groupable_statement_keywords = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def is_groupable(query: str) -> bool:
+    """Checks if single SQL query is a plain data modification, which can share transaction with another ones."""
+
+    return query.lstrip(" \t\r\n").upper().startswith(groupable_statement_keywords)
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class GroupCommitter:
+    """Coalesces concurrent single writes into shared transactions with one commit.
+
+    Every write is executed inside its own savepoint, so failed write doesn't affect another ones,
+    callers receive their results only after shared transaction was committed.
+    """
+
+    def __init__(self, pool: ConnectionPool, window: float, max_batch_size: int, result_cache: ResultCache | None = None) -> None:
+        """Stores group commit settings, writes are processed after `start` method call."""
+
+        self.pool = pool
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.result_cache = result_cache
+
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self) -> None:
+        """Starts processing of queued writes."""
+
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stops processing of queued writes."""
+
+        if self.task is not None:
+            self.task.cancel()
+
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+
+    async def execute(self, query: str, params: list | dict = ()) -> tuple[list[str] | None, list[tuple] | None, float]:
+        """Queues single write and waits until it's committed. Retrieves result columns, rows and time spent waiting for connection."""
+
+        self.queue.put_nowait((future := asyncio.get_running_loop().create_future(), query, params))
+        return await future
+
+    async def run(self) -> None:
+        """Collects queued writes into batches and processes them one by one."""
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.window
+
+            # Waiting for another writes until window is closed or batch is full
+            while len(batch) < self.max_batch_size:
+
+                try:
+
+                    if (timeout := deadline - time.monotonic()) > 0:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+
+                    else:
+                        batch.append(self.queue.get_nowait())
+
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+
+            await self.process(batch)
+
+    async def process(self, batch: list[tuple[asyncio.Future, str, list | dict]]) -> None:
+        """Executes batch of writes in one transaction, every write in its own savepoint.
+
+        Write rolling back whole transaction fails alone, another writes of batch are executed again in new transaction.
+        """
+
+        pending = list(batch)
+
+        try:
+
+            async with self.pool.acquire() as (database, wait_time):
+
+                while pending:
+                    results = list()
+                    written_tables = list()
+                    aborted = None
+
+                    # Lonely write doesn't need savepoint, its failure doesn't affect another ones
+                    if not (single := len(pending) == 1):
+                        await database.execute("BEGIN;")
+
+                    for index, (future, query, params) in enumerate(pending):
+
+                        try:
+
+                            if not single:
+                                await database.execute("SAVEPOINT group_commit_request;")
+
+                            with self.pool.deadline(database):
+                                async with self.pool.execute(database, query, params) as cursor:
+                                    description = [column[0] for column in cursor.description] if cursor.description else None
+                                    data = await cursor.fetchall() if description else None
+
+                            written_tables.append(self.pool.accessed_tables(database, query))
+
+                            if not single:
+                                await database.execute("RELEASE group_commit_request;")
+
+                            results.append((future, (description, data, wait_time)))
+
+                        # Rolling back only failed write
+                        except aiosqlite.Error as error:
+
+                            if not single:
+
+                                try:
+                                    await database.execute("ROLLBACK TO group_commit_request;")
+                                    await database.execute("RELEASE group_commit_request;")
+
+                                # If write rolled back whole transaction, like `INSERT OR ROLLBACK`, `RAISE(ROLLBACK)` or interrupted statement do
+                                except aiosqlite.Error:
+
+                                    if database.in_transaction:
+                                        await database.rollback()
+
+                                    if not future.done():
+                                        future.set_exception(error)
+
+                                    aborted = index
+                                    break
+
+                            results.append((future, error))
+
+                    # If transaction wasn't rolled back
+                    if aborted is None:
+                        await database.commit()
+                        break
+
+                    # Writes executed before failed one were rolled back too, so they are executed again
+                    pending = pending[:aborted] + pending[aborted + 1:]
+
+        # If whole transaction failed, every write is failed
+        except Exception as error:
+
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+            return
+
+        # Invalidating cached results of written tables
+        if self.result_cache is not None:
+            for tables in written_tables:
+                self.result_cache.invalidate(tables)
+
+        # Sending results to callers, which are still waiting for them
+        for future, result in results:
+            if future.done():
+                continue
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+
+            else:
+                future.set_result(result)
@@ -1,21 +1,170 @@
 import os
 import time
 import json
+import shutil
+import typing
+import asyncio
 import uvicorn
+import tempfile
+import contextlib
 import fastapi
 import aiosqlite
+import starlette.background
 
 # Local imports
 import sqlfunctions
 
 from misc import *
+from pool import *
 from validation import *
+from serialization import *
+from cache import *
+from metrics import *
+from slow_queries import *
+from group_commit import *
+from admission import *
+from workers import *
+from sharding import *
+from changes import *
 
 # Global and static variables, constants
 application = fastapi.FastAPI(docs_url=None)
 config = read_toml_config("config.toml")
 
+log_writer.configure(config["logging"]["output"], config["logging"]["queue_size"], config["logging"]["sample_rate"])
+
+metrics = Metrics(config["metrics"]["max_fingerprints"]) if config["metrics"]["enabled"] else None
+
+# Several worker processes share WAL database, their writers are serialized by lock file
+workers_count = config["workers"]["count"]
+is_worker = os.environ.get(worker_environment_variable) == "1"
+write_lock = FileLock(config["database"]["file_path"] + ".lock") if workers_count > 1 and fcntl is not None else None
+
+# Tuning pragmas applied to every database connection
+performance_pragmas = {name: config["performance"][name] for name in ["mmap_size", "cache_size", "temp_store", "synchronous"]}
+
+
+def create_pool(file_path: str, write_lock: FileLock | None, track_tables: bool = False) -> ConnectionPool:
+    """Creates connections pool of database file with configured pool settings."""
+
+    return ConnectionPool(
+        file_path,
+        config["pool"]["size"],
+        config["pool"]["acquire_timeout"],
+        sqlfunctions.sql_functions,
+        config["pool"]["wal"] or workers_count > 1,
+        config["pool"]["statement_cache_size"],
+        query_timeout=config["limits"]["query_timeout"],
+        wait_histogram=metrics.pool_wait if metrics is not None else None,
+        write_lock=write_lock,
+        pragmas=performance_pragmas,
+        track_tables=track_tables,
+    )
+
+
 database_path = config["database"]["file_path"]
+pool = create_pool(database_path, write_lock, track_tables=config["result_cache"]["enabled"])
+
+# Results of user functions, which aren't marked deterministic, are never cached
+nondeterministic_functions = [sql_function_name(function) for function in sqlfunctions.sql_functions if not isinstance(function, type) and not getattr(function, "deterministic", False)]
+result_cache = ResultCache(config["result_cache"]["ttl"], config["result_cache"]["max_size"], nondeterministic_functions) if config["result_cache"]["enabled"] else None
+group_committer = GroupCommitter(pool, config["group_commit"]["window"], config["group_commit"]["max_batch_size"], result_cache) if config["group_commit"]["enabled"] else None
+
+# Named databases, every file of sharded database has its own connections pool, writer and lock file
+sharded_databases = {
+    name: ShardedDatabase([create_pool(file_path, FileLock(file_path + ".lock") if write_lock is not None else None) for file_path in files])
+    for name, files in config["shards"].items()
+}
+
+slow_query_log = SlowQueryLog(database_path, sqlfunctions.sql_functions, config["slow_queries"]["threshold"], config["slow_queries"]["size"]) if config["slow_queries"]["enabled"] else None
+change_feed = ChangeFeed(
+    pool,
+    config["changes"]["tables"],
+    config["changes"]["interval"],
+    config["changes"]["max_rowids"],
+    config["changes"]["retention"],
+    config["changes"]["queue_size"],
+) if config["changes"]["enabled"] else None
+background_tasks = list()
+backup_lock = asyncio.Lock()
+
+# Errors of queries rejected by admission control or interrupted by timeouts
+overload_errors = (OverloadError, QueryTimeoutError, PoolTimeoutError)
+
+rate_limiter = TokenBucketLimiter(config["limits"]["rate"], config["limits"]["burst"])
+admission = AdmissionController(config["limits"]["max_in_flight"], config["limits"]["max_queued"], config["limits"]["queue_timeout"])
+
+# Request bodies schemas, compiled once instead of on every request
+query_body_schema = ParamsSchema(["password", "query", "single", "params", "stream", "stream_format", "format", "layout"], [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    (None, list(), bool),
+    (None, list(), (list, dict)),
+    (None, list(), bool),
+    (None, ["ndjson", "json"], str),
+    (None, response_formats, str),
+    (None, response_layouts, str),
+], ["params", "stream", "stream_format", "format", "layout"])
+
+bulk_body_schema = ParamsSchema(["password", "query"], [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+])
+
+batch_body_schema = ParamsSchema(["password", "statements", "transaction", "format"], [
+    ((r"(.*)", None, None), list(), str),
+    (None, list(), list),
+    (None, list(), bool),
+    (None, response_formats, str),
+], ["transaction", "format"])
+
+shards_body_schema = ParamsSchema(["password", "database", "query", "single", "params", "key", "order_by", "limit", "format", "layout"], [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    (None, list(), bool),
+    (None, list(), (list, dict)),
+    (None, list(), (int, str)),
+    (None, list(), list),
+    ((0, None), list(), int),
+    (None, response_formats, str),
+    (None, response_layouts, str),
+], ["params", "key", "order_by", "limit", "format", "layout"])
+
+batch_statement_schema = ParamsSchema(["query", "params"], [((r"(.*)", None, None), list(), str), (None, list(), (list, dict))], ["params"])
+
+changes_params_schema = ParamsSchema(["password", "tables", "since"], [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    ((r"^\d{1,18}$", None, None), list(), str),
+], ["tables", "since"])
+
+backup_body_schema = ParamsSchema(["password", "database", "shard"], [
+    ((r"(.*)", None, None), list(), str),
+    ((r"(.*)", None, None), list(), str),
+    ((0, None), list(), int),
+], ["database", "shard"])
+
+session_message_limitations = [
+    (None, list(), (str, int)),
+    (None, ["query", "begin", "commit", "rollback"], str),
+    ((r"(.*)", None, None), list(), str),
+    (None, list(), bool),
+    (None, list(), (list, dict)),
+]
+
+# Transaction control messages don't contain query
+session_query_schema = ParamsSchema(["id", "action", "query", "single", "params"], session_message_limitations, ["action", "params"])
+session_control_schema = ParamsSchema(["id", "action", "query", "single", "params"], session_message_limitations, ["action", "params", "query", "single"])
+
+# If password list is empty
+if not config["database"]["allowed_passwords"]:
+    query_body_schema = query_body_schema.without("password")
+    bulk_body_schema = bulk_body_schema.without("password")
+    batch_body_schema = batch_body_schema.without("password")
+    shards_body_schema = shards_body_schema.without("password")
+    changes_params_schema = changes_params_schema.without("password")
+    backup_body_schema = backup_body_schema.without("password")
 
 
 # ==-----------------------------------------------------------------------------== #
@@ -24,35 +173,442 @@ database_path = config["database"]["file_path"]
 async def startup() -> None:
     """Event handler, starts every time with script startup."""
 
+    # Opening database connections pool
+    await pool.open()
+
+    # Opening connections pools of named databases shards
+    for sharded_database in sharded_databases.values():
+        await sharded_database.open()
+
+    # Opening connection explaining slow queries
+    if slow_query_log is not None:
+        await slow_query_log.open()
+
+    # Watching for database changes made outside of the server or by another workers
+    if result_cache is not None and (config["result_cache"]["watch_data_version"] or is_worker):
+        start_background_task(result_cache.watch_data_version(database_path, config["result_cache"]["data_version_interval"]), "result cache watcher")
+
+    # Starting processing of grouped writes
+    if group_committer is not None:
+        group_committer.start()
+
+    # Saving worker metrics to aggregate them with metrics of another workers
+    if is_worker and metrics is not None:
+        background_tasks.append(asyncio.create_task(save_worker_metrics(os.environ[metrics_directory_environment_variable], config["workers"]["metrics_interval"])))
+
+    # Database is prepared once by parent process in multi-process mode
+    if not is_worker:
+        await prepare_database()
+
+    # Loading tables and indexes pages into caches before serving requests
+    if config["performance"]["prewarm"]:
+        start_time = time.perf_counter()
+        objects = await pool.prewarm(config["performance"]["prewarm_tables"])
+        await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}Prewarmed {len(objects)} tables and indexes in {time.perf_counter() - start_time:.3f} sec(s)")
+
+    # Pushing changes of captured tables to subscribers, every worker watches changes for its own subscribers
+    if change_feed is not None:
+        start_background_task(change_feed.watch(), "change feed")
+
+
+async def prepare_database() -> None:
+    """Logs service address and executes startup SQL script."""
+
     # await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}Started database service")
     await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}Database is ON and accessible on route %lwhite`{config['database']['route']}`")
     await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}Service is avilabe on %lwhitehttp://{config['database']['host']}:{config['database']['port']}")
 
     # If SQL starup script wasn't found
     if not os.path.exists("startup.sql"):
-        await log(rf"%magenta[%now] %yellowWARN%reset:{' ' * 2}SQL script `startup.sql` not found. Create it to execute SQL script on startup")
+        await log(rf"%magenta[%now] %yellowWARN%reset:{' ' * 2}SQL script `startup.sql` not found. Create it to execute SQL script on startup", level="WARN")
 
     else:
 
         # Executing SQL query
-        async with aiosqlite.connect(database_path) as database:
-
-            # Registarting SQL function
-            await registrate_sqlite_functions(database, *sqlfunctions.sql_functions)
-
-            # Allowing to use foreign keys
-            await database.execute("PRAGMA foreign_keys = ON;")
-            await database.commit()
+        async with pool.acquire() as (database, _):
 
             # Executing startup SQL script
             try:
 
                 with open("startup.sql", "r", encoding="utf-8") as file:
-                    await database.executescript(file.read())
+                    await pool.executescript(database, file.read())
                     await database.commit()
 
             except Exception:
-                await log(rf"%magenta[%now] %redERROR%reset:{' '}Error while executing startup SQL script. Fix it and and start the script again")
+                await log(rf"%magenta[%now] %redERROR%reset:{' '}Error while executing startup SQL script. Fix it and and start the script again", level="ERROR")
+
+    # Creating triggers capturing changes of tables, tables have to be created by startup script
+    if change_feed is not None:
+
+        try:
+
+            # If some of the tables don't exist or are `WITHOUT ROWID` tables
+            if skipped_tables := await change_feed.prepare():
+                await log(rf"%magenta[%now] %yellowWARN%reset:{' ' * 2}Changes of tables without rowid or missing tables aren't captured: {', '.join(skipped_tables)}", level="WARN")
+
+        except aiosqlite.Error as error:
+            await log(rf"%magenta[%now] %redERROR%reset:{' '}Unable to capture changes of tables: {error}", level="ERROR")
+
+    # Triggers and changes left by disabled change feed aren't needed anymore
+    else:
+
+        try:
+            async with pool.acquire() as (database, _):
+                await remove_changes(database)
+
+        except aiosqlite.Error as error:
+            await log(rf"%magenta[%now] %redERROR%reset:{' '}Unable to remove triggers capturing changes of tables: {error}", level="ERROR")
+
+
+async def prepare_workers() -> None:
+    """Prepares database once before worker processes are started."""
+
+    await pool.open()
+
+    try:
+        await prepare_database()
+
+    finally:
+        await pool.close()
+
+
+def start_background_task(coroutine: typing.Coroutine, name: str) -> None:
+    """Starts background task stopped on shutdown, its unexpected exit is logged."""
+
+    def log_exit(task: asyncio.Task) -> None:
+        """Logs background task exit, if it wasn't cancelled."""
+
+        if not task.cancelled():
+            log_writer.put((time.time(), "ERROR", rf"%magenta[%now] %redERROR%reset:{' '}Background task `{name}` stopped: {task.exception() or 'finished'}", True, None))
+
+    background_tasks.append(task := asyncio.create_task(coroutine, name=name))
+    task.add_done_callback(log_exit)
+
+
+async def save_worker_metrics(directory: str, interval: float) -> None:
+    """Periodically saves worker metrics snapshot, which is read by another workers."""
+
+    while True:
+        write_worker_snapshot(directory, metrics.snapshot(*collect_service_metrics()))
+        await asyncio.sleep(interval)
+
+
+async def shutdown() -> None:
+    """Event handler, starts every time with script shutdown."""
+
+    # Stopping background tasks
+    for task in background_tasks:
+        task.cancel()
+
+    if group_committer is not None:
+        await group_committer.stop()
+
+    # Closing database connections pool
+    await pool.close()
+
+    for sharded_database in sharded_databases.values():
+        await sharded_database.close()
+
+    # Dropping metrics of stopped worker
+    if is_worker and metrics is not None:
+        remove_worker_snapshot(os.environ[metrics_directory_environment_variable])
+
+    if slow_query_log is not None:
+        await slow_query_log.close()
+
+    # Writing remaining log records
+    log_writer.stop()
+
+
+# ==-----------------------------------------------------------------------------== #
+# Query execution                                                                   #
+# ==-----------------------------------------------------------------------------== #
+async def execute_on_connection(
+    database: aiosqlite.Connection,
+    query: str,
+    params: list | dict = (),
+    single: bool = True,
+    counters: bool = False,
+) -> tuple[dict[str, typing.Any], tuple[frozenset[str], frozenset[str], bool] | None]:
+    """Executes single SQL query or script on given connection without commit. Retrieves result and accessed tables.
+
+    With `counters` result of single query also contains count of modified rows and ID of the last inserted row.
+    """
+
+    # If executing only one SQL query, not script
+    if single:
+
+        with pool.deadline(database):
+            async with pool.execute(database, query, params) as cursor:
+                description = [column[0] for column in cursor.description] if cursor.description else None
+                data = await cursor.fetchall() if description else None
+
+                result = ({"columns": description, "data": data} if description else dict()) | ({"rowcount": cursor.rowcount, "lastrowid": cursor.lastrowid} if counters else dict())
+
+        return result, pool.accessed_tables(database, query)
+
+    with pool.deadline(database):
+        await pool.executescript(database, query)
+
+    return dict(), pool.accessed_tables(database)
+
+
+async def execute_query(query: str, params: list | dict = (), single: bool = True) -> dict[str, typing.Any]:
+    """Executes and commits single SQL query or script, recording its metrics. Retrieves response content."""
+
+    # If metrics and slow queries log are disabled
+    if metrics is None and slow_query_log is None:
+        return await run_query(query, params, single)
+
+    start_time = time.perf_counter()
+
+    try:
+        content = await run_query(query, params, single)
+
+    except Exception as error:
+
+        if metrics is not None:
+            metrics.observe_query("single" if single else "script", query, "Error", time.perf_counter() - start_time, error=error)
+
+        raise
+
+    if metrics is not None:
+        metrics.observe_query("single" if single else "script", query, "OK", time.perf_counter() - start_time, len(content.get("data") or ()))
+
+    # Only single queries can be explained
+    if slow_query_log is not None and single:
+        slow_query_log.observe(query, params, float(content["execution_time_secs"]))
+
+    return content
+
+
+async def run_query(query: str, params: list | dict = (), single: bool = True) -> dict[str, typing.Any]:
+    """Executes and commits single SQL query or script using results cache, grouped writes and pool connections. Retrieves response content."""
+
+    # Single SELECT queries are served by read-only connections in WAL mode and can be cached
+    readonly = single and (pool.wal or result_cache is not None) and await pool.is_readonly(query, params)
+    cacheable = readonly and result_cache is not None and result_cache.is_cacheable(query)
+
+    # If query result was cached
+    if cacheable and (cached_result := result_cache.get(cache_key := result_cache.key(query, params))) is not None:
+        return {"status": "OK", "execution_time_secs": f"{0:.7f}", "pool_wait_time_secs": f"{0:.7f}", "cached": True} | cached_result
+
+    # Waiting for free execution slot
+    async with admission.admit():
+
+        # If write can share transaction with another concurrent writes
+        if group_committer is not None and single and is_groupable(query):
+            start_time = time.perf_counter()
+            description, data, wait_time = await group_committer.execute(query, params)
+
+            stop_time = time.perf_counter()
+            execution_time = f"{stop_time - start_time:.7f}"
+
+            return {"status": "OK", "execution_time_secs": execution_time, "pool_wait_time_secs": f"{wait_time:.7f}"} | ({"columns": description, "data": data} if description else dict())
+
+        # Executing SQL query
+        async with pool.acquire(readonly) as (database, wait_time):
+            cache_generation = result_cache.generation if result_cache is not None else None
+
+            start_time = time.perf_counter()
+            result, tables = await execute_on_connection(database, query, params, single)
+            await database.commit()
+
+            stop_time = time.perf_counter()
+            execution_time = f"{stop_time - start_time:.7f}"
+
+    # Caching read result or invalidating cached results of written tables
+    if result_cache is not None:
+
+        if cacheable and result and tables is not None:
+            result_cache.put(cache_key, result, tables[0], cache_generation)
+
+        elif not readonly:
+            result_cache.invalidate(tables)
+
+    return {"status": "OK", "execution_time_secs": execution_time, "pool_wait_time_secs": f"{wait_time:.7f}"} | ({"cached": False} if cacheable else dict()) | result
+
+
+# ==-----------------------------------------------------------------------------== #
+# Response streaming                                                                #
+# ==-----------------------------------------------------------------------------== #
+async def stream_query_result(query: str, params: list | dict, readonly: bool, stream_format: str) -> typing.AsyncIterator[bytes]:
+    """Executes single SQL query and yields its result by batches of rows as NDJSON lines or JSON array chunks.
+
+    First chunk is yielded only after query was executed, so errors of execution can be reported before response is started.
+    Connection is held until the last row is sent, client disconnect closes the generator and returns connection to pool.
+    """
+
+    rows_count = 0
+    async with admission.admit(), pool.acquire(readonly) as (database, wait_time):
+
+        start_time = time.perf_counter()
+
+        # Deadlines limit only execution and fetching, time spent waiting for slow client isn't counted
+        with pool.deadline(database):
+            cursor = await pool.execute(database, query, params)
+
+        async with cursor:
+            description = [column[0] for column in cursor.description] if cursor.description else None
+
+            # Result head containing columns names
+            if stream_format == "ndjson":
+                yield (json.dumps({"columns": description}) + "\n").encode()
+
+            else:
+                yield ('{"columns": %s, "data": [' % json.dumps(description)).encode()
+
+            try:
+
+                # Fetching rows by batches, every batch is sent before the next one is fetched
+                while description:
+
+                    with pool.deadline(database):
+                        if not (rows := await cursor.fetchmany(config["streaming"]["batch_size"])):
+                            break
+
+                    rows_data = [json.dumps(row, default=encode_json_value) for row in rows]
+
+                    if stream_format == "ndjson":
+                        yield ("\n".join(rows_data) + "\n").encode()
+
+                    else:
+                        yield ((", " if rows_count else "") + ", ".join(rows_data)).encode()
+
+                    rows_count += len(rows)
+
+                await database.commit()
+
+                # Invalidating cached results of written tables
+                if result_cache is not None and not readonly:
+                    result_cache.invalidate(pool.accessed_tables(database, query))
+
+                status = {"status": "OK", "execution_time_secs": f"{time.perf_counter() - start_time:.7f}", "pool_wait_time_secs": f"{wait_time:.7f}", "rows_count": rows_count}
+
+            # Response is already started, so error is reported in result tail
+            except aiosqlite.Error as error:
+                status = {"status": "Error", "detail": ["SQLite error: %s" % error], "rows_count": rows_count}
+
+            except (TypeError, ValueError) as error:
+                status = {"status": "Error", "detail": ["Unable to encode result row: %s" % error], "rows_count": rows_count}
+
+    # Recording streamed query metrics
+    if metrics is not None:
+        metrics.observe_query("stream", query, status["status"], time.perf_counter() - start_time, rows_count)
+
+    # Result tail containing execution status
+    if stream_format == "ndjson":
+        yield (json.dumps(status) + "\n").encode()
+
+    else:
+        yield ("], %s" % json.dumps(status)[1:]).encode()
+
+
+async def stream_changes(subscription: Subscription, since: int | None) -> typing.AsyncIterator[bytes]:
+    """Yields server-sent events of subscribed tables changes, changes missed by reconnected client are sent first."""
+
+    # Changes published after subscription are received from its queue
+    until = subscription.start_id
+
+    try:
+        yield b"retry: 1000\n\n"
+
+        # If client reconnected after receiving change with `since` identifier
+        if since is not None and since < until:
+            complete, changes = await change_feed.replay(since, until)
+
+            if not complete:
+                yield format_event("overflow", {"detail": "Missed changes were deleted, reread subscribed tables"}, until)
+
+            elif changes := subscription.select(changes):
+                yield format_event("changes", {"id": until, "changes": changes}, until)
+
+        while True:
+
+            # Keeping idle connection alive
+            if (item := await subscription.get(config["changes"]["heartbeat"])) is None:
+                yield b": keepalive\n\n"
+                continue
+
+            change_id, changes = item
+
+            # If client didn't read changes fast enough
+            if change_id is None:
+                yield format_event("overflow", {"detail": "Too many changes weren't sent, reread subscribed tables"})
+                continue
+
+            yield format_event("changes", {"id": change_id, "changes": changes}, change_id)
+
+    finally:
+        change_feed.unsubscribe(subscription)
+
+
+# ==-----------------------------------------------------------------------------== #
+# Metrics                                                                           #
+# ==-----------------------------------------------------------------------------== #
+def collect_service_metrics() -> tuple[dict[str, int | float], dict[str, int | float]]:
+    """Retrieves counters and gauges of pool, caches, limits and logging for metrics."""
+
+    statement_cache = pool.statement_cache_statistics()
+    counters = {
+        "database_statement_cache_hits_total": statement_cache["hits"],
+        "database_statement_cache_misses_total": statement_cache["misses"],
+        "database_rate_limited_total": rate_limiter.rejected,
+        "database_overload_rejected_total": admission.rejected,
+        "database_query_timeouts_total": pool.query_timeouts,
+        "database_log_records_dropped_total": log_writer.dropped,
+    }
+    gauges = {"database_queries_in_flight": admission.in_flight, "database_queries_waiting": admission.waiting}
+
+    # If change feed is enabled
+    if change_feed is not None:
+        gauges |= {"database_change_subscribers": len(change_feed.subscriptions)}
+
+    # If results cache is enabled
+    if result_cache is not None:
+        counters |= {"database_result_cache_hits_total": result_cache.hits, "database_result_cache_misses_total": result_cache.misses}
+        gauges |= {"database_result_cache_entries": len(result_cache.entries), "database_result_cache_size_bytes": result_cache.size}
+
+    return counters, gauges
+
+
+# ==-----------------------------------------------------------------------------== #
+# Requests rejection                                                                #
+# ==-----------------------------------------------------------------------------== #
+async def reject_rate_limited(client: typing.Any, event: str) -> fastapi.Response | None:
+    """Retrieves logged rejection response, if client exceeded allowed requests rate."""
+
+    # If client bucket still contains token
+    if rate_limiter.allow(client.host):
+        return None
+
+    await log_access(client, event, "Rate limited", ok=False)
+    return rejection_response(429, "Too many requests, retry later", rate_limiter.retry_after(client.host))
+
+
+def overload_status(error: Exception) -> tuple[str, str]:
+    """Retrieves access log status and error detail of query rejected by admission control or timed out."""
+
+    if isinstance(error, OverloadError):
+        return "Overloaded", "Server is overloaded: %s" % error
+
+    if isinstance(error, QueryTimeoutError):
+        return "Query timeout", "Query timeout: %s" % error
+
+    return "Pool timeout", "Database is busy: %s" % error
+
+
+async def reject_overloaded(client: typing.Any, event: str, error: Exception, detail: list[str] | None = None) -> fastapi.Response | dict[str, typing.Any]:
+    """Retrieves logged response of query rejected by admission control or timed out, `detail` is added to timeouts error detail."""
+
+    status, message = overload_status(error)
+    await log_access(client, event, status, ok=False)
+
+    # Overloaded server asks client to retry later
+    if isinstance(error, OverloadError):
+        return rejection_response(503, message, 1)
+
+    return {"status": "Error", "detail": [message, *(detail or ())]}
 
 
 # ==-----------------------------------------------------------------------------== #
@@ -64,84 +620,917 @@ async def execute_sql_handler(request: fastapi.Request) -> fastapi.Response:
 
     # If allowed IP list is not empty and request IP is not allowed
     if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
-        await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %greenOK")
+        await log_access(request.client, "Database accessed", "IP not allowed", ok=False)
         return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
 
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Database accessed")) is not None:
+        return rejection
+
     try:
 
         # Getting request body in JSON format
         body = await request.json()
 
-        # Required request body params and their limitations
-        required_params = ["password", "query", "single"]
-        required_params_limitations = [
-            ((r"(.*)", None, None), list(), str),
-            ((r"(.*)", None, None), list(), str),
-            (None, list(), bool),
-        ]
-
-        # If password list is empty
-        if not config["database"]["allowed_passwords"]:
-            del required_params[0]
-            del required_params_limitations[0]
-
         # Params validation
-        if validation_errors := await validate_params(body, required_params, required_params_limitations):
-            await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %redValidation failed")
+        if validation_errors := query_body_schema.validate(body):
+            await log_access(request.client, "Database accessed", "Validation failed", ok=False)
             return {"status": "Error", "detail": validation_errors}
 
+        # If query params or streaming were received for SQL script
+        if not body["single"] and (unexpected_params := [param for param in ["params", "stream", "stream_format"] if param in body]):
+            await log_access(request.client, "Database accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["Param `%s` can only be used with `single` queries" % param for param in unexpected_params]}
+
         # If password is required and password is invalid
-        if "password" in required_params and body["password"] not in config["database"]["allowed_passwords"]:
-            await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %redInvalid password")
+        if config["database"]["allowed_passwords"] and body["password"] not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Database accessed", "Invalid password", ok=False)
             return {"status": "Error", "detail": ["Invalid password"]}
 
+        # Response encoding negotiation
+        response_format = negotiate_format(body.get("format"), request.headers.get("accept", ""))
+        compression = negotiate_compression(request.headers.get("accept-encoding", ""))
+
+        # If MessagePack was requested but isn't installed
+        if response_format == "msgpack" and msgpack is None:
+            await log_access(request.client, "Database accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["MessagePack format is not supported by server"]}
+
+        # If query result have to be streamed by batches of rows
+        if body["single"] and body.get("stream"):
+            readonly = pool.wal and await pool.is_readonly(body["query"], body.get("params", ()))
+
+            stream = stream_query_result(body["query"], body.get("params", ()), readonly, stream_format := body.get("stream_format", "ndjson"))
+            head = await anext(stream)
+
+            await log_access(request.client, "Database accessed", "OK streaming", fingerprint=fingerprint_query(body["query"]))
+            stream = prepend(head, stream) if metrics is None else metrics.observe_stream("stream", prepend(head, stream))
+            return fastapi.responses.StreamingResponse(stream, media_type="application/x-ndjson" if stream_format == "ndjson" else "application/json")
+
         # Executing SQL query
-        async with aiosqlite.connect(database_path) as database:
+        content = await execute_query(body["query"], body.get("params", ()), body["single"])
 
-            # Registarting SQL function
-            await registrate_sqlite_functions(database, *sqlfunctions.sql_functions)
+        await log_access(request.client, "Database accessed", "OK", duration=float(content["execution_time_secs"]), fingerprint=fingerprint_query(body["query"]))
+        response = encode_response(content, response_format, body.get("layout", "rows"), compression, config["encoding"]["compression_level"], config["encoding"]["min_compression_size"])
 
-            # Allowing to use foreign keys
-            await database.execute("PRAGMA foreign_keys = ON;")
-            await database.commit()
+        if metrics is not None:
+            metrics.observe_response("query", len(response.body))
 
-            # If executing only one SQL query, not script
-            start_time = time.perf_counter()
-            if body["single"]:
+        return response
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Database accessed", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    except overload_errors as error:
+        return await reject_overloaded(request.client, "Database accessed", error)
+
+    except aiosqlite.Error as error:
+        await log_access(request.client, "Database accessed", "SQLite exception", ok=False)
+        return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+    except Exception as error:
+        await log_access(request.client, "Database accessed", "Invalid exception", ok=False)
+        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+
+
+@application.post(config["database"]["route"] + "/bulk")
+async def bulk_insert_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for executing one parameterized SQL query for a lot of rows in chunked transactions."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Bulk insert", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Bulk insert")) is not None:
+        return rejection
+
+    rows_count = 0
+
+    try:
+
+        # If rows are streamed as NDJSON or CSV, other params are received in URL
+        if (content_type := request.headers.get("content-type", "").split(";")[0].strip()) in ["application/x-ndjson", "text/csv"]:
+            body = dict(request.query_params)
+
+            if content_type == "text/csv":
+                rows = read_csv_rows(request.stream(), body.get("header", "false").lower() == "true")
+
+            else:
+                rows = read_ndjson_rows(request.stream())
+
+        # Getting request body in JSON format
+        else:
+            body = await request.json()
+            rows = body.get("rows") if isinstance(body, dict) else None
+
+        # Params validation
+        if validation_errors := bulk_body_schema.validate(body):
+            await log_access(request.client, "Bulk insert", "Validation failed", ok=False)
+            return {"status": "Error", "detail": validation_errors}
+
+        # If rows weren't received in JSON body
+        if not isinstance(rows, list) and not hasattr(rows, "__aiter__"):
+            await log_access(request.client, "Bulk insert", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["Param `rows` have to be `list` type"]}
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and body["password"] not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Bulk insert", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+        # Executing SQL query chunk by chunk, connection is acquired only while chunk is written
+        wait_time = 0
+        start_time = time.perf_counter()
+        async for chunk in iterate_chunks(rows, config["bulk"]["chunk_size"]):
 
-                async with database.execute(body["query"]) as cursor:
-                    description = [column[0] for column in cursor.description] if cursor.description else None
-                    data = await cursor.fetchall() if description else None
+            async with admission.admit(), pool.acquire() as (database, chunk_wait_time):
+
+                with pool.deadline(database):
+                    await pool.executemany(database, body["query"], chunk)
 
                 await database.commit()
 
-                stop_time = time.perf_counter()
-                execution_time = f"{stop_time - start_time:.7f}"
+                # Invalidating cached results of written tables
+                if result_cache is not None:
+                    result_cache.invalidate(pool.accessed_tables(database, body["query"]))
 
-                await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %greenOK")
-                return {"status": "OK", "execution_time_secs": execution_time} | ({"columns": description, "data": data} if description else dict())
+            rows_count += len(chunk)
+            wait_time += chunk_wait_time
 
-            await database.executescript(body["query"])
-            await database.commit()
+        stop_time = time.perf_counter()
+        execution_time = f"{stop_time - start_time:.7f}"
 
-            stop_time = time.perf_counter()
-            execution_time = f"{stop_time - start_time:.7f}"
+        if metrics is not None:
+            metrics.observe_query("bulk", body["query"], "OK", stop_time - start_time)
 
-            await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %greenOK")
-            return {"status": "OK", "execution_time_secs": execution_time}
+        rows_per_second = f"{rows_count / (stop_time - start_time):.2f}" if stop_time > start_time else "0.00"
+
+        await log_access(request.client, "Bulk insert", "OK", duration=float(execution_time), rows=rows_count, fingerprint=fingerprint_query(body["query"]))
+        return {"status": "OK", "execution_time_secs": execution_time, "pool_wait_time_secs": f"{wait_time:.7f}", "rows_count": rows_count, "rows_per_sec": rows_per_second}
 
     except json.decoder.JSONDecodeError:
-        await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %redBody parse exception")
-        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+        await log_access(request.client, "Bulk insert", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body", "Rows committed before error: %s" % rows_count]}
+
+    except overload_errors as error:
+        return await reject_overloaded(request.client, "Bulk insert", error, ["Rows committed before error: %s" % rows_count])
 
     except aiosqlite.Error as error:
-        await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %redSQLite exception")
-        return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+        await log_access(request.client, "Bulk insert", "SQLite exception", ok=False)
+
+        if metrics is not None:
+            metrics.observe_query("bulk", body["query"], "Error", time.perf_counter() - start_time, error=error)
+
+        return {"status": "Error", "detail": ["SQLite error: %s" % error, "Rows committed before error: %s" % rows_count]}
 
     except Exception as error:
-        await log(rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{request.client.host}:{request.client.port} - %lwhite'Database accessed' %redInvalid exception")
-        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+        await log_access(request.client, "Bulk insert", "Invalid exception", ok=False)
+        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error, "Rows committed before error: %s" % rows_count]}
 
 
-application.add_event_handler("startup", startup)
-uvicorn.run(app=application, host=config["database"]["host"], port=config["database"]["port"], log_level="critical")
+@application.post(config["database"]["route"] + "/batch")
+async def execute_batch_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for executing ordered list of single SQL queries on one connection, optionally in one transaction."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Batch executed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Batch executed")) is not None:
+        return rejection
+
+    try:
+
+        # Getting request body in JSON format
+        body = await request.json()
+
+        # Params validation
+        if validation_errors := batch_body_schema.validate(body):
+            await log_access(request.client, "Batch executed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": validation_errors}
+
+        # If there are too many or no statements at all
+        if not 0 < len(body["statements"]) <= config["batch"]["max_statements"]:
+            await log_access(request.client, "Batch executed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["Param `statements` have to contain from `1` to `%s` statement(s)" % config["batch"]["max_statements"]]}
+
+        # Statements validation
+        for index, statement in enumerate(body["statements"]):
+
+            if not isinstance(statement, dict):
+                validation_errors.append("Statement `%s` have to be `dict` type" % index)
+                continue
+
+            statement_errors = batch_statement_schema.validate(statement)
+            validation_errors.extend(["Statement `%s`: %s" % (index, error) for error in statement_errors])
+
+        if validation_errors:
+            await log_access(request.client, "Batch executed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": validation_errors}
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and body["password"] not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Batch executed", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+        # Response encoding negotiation
+        response_format = negotiate_format(body.get("format"), request.headers.get("accept", ""))
+        compression = negotiate_compression(request.headers.get("accept-encoding", ""))
+
+        # If MessagePack was requested but isn't installed
+        if response_format == "msgpack" and msgpack is None:
+            await log_access(request.client, "Batch executed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["MessagePack format is not supported by server"]}
+
+        # Batch of SELECT queries only is served by read-only connection in WAL mode
+        readonly = pool.wal and all([await pool.is_readonly(statement["query"], statement.get("params", ())) for statement in body["statements"]])
+        transaction = body.get("transaction", False)
+
+        results = list()
+        written_tables = list()
+
+        # Executing SQL queries one by one
+        async with admission.admit(), pool.acquire(readonly) as (database, wait_time):
+
+            start_time = time.perf_counter()
+            if transaction:
+                await database.execute("BEGIN;")
+
+            for statement in body["statements"]:
+
+                statement_start_time = time.perf_counter()
+
+                try:
+                    result, tables = await execute_on_connection(database, statement["query"], statement.get("params", ()), counters=True)
+
+                    # Every statement is committed separately outside of transaction
+                    if not transaction:
+                        await database.commit()
+
+                    results.append({"status": "OK"} | result)
+                    written_tables.append(tables)
+
+                    if metrics is not None:
+                        metrics.observe_query("batch", statement["query"], "OK", time.perf_counter() - statement_start_time, len(result.get("data") or ()))
+
+                    if slow_query_log is not None:
+                        slow_query_log.observe(statement["query"], statement.get("params", ()), time.perf_counter() - statement_start_time)
+
+                except aiosqlite.Error as error:
+                    results.append({"status": "Error", "detail": ["SQLite error: %s" % error]})
+
+                    if metrics is not None:
+                        metrics.observe_query("batch", statement["query"], "Error", time.perf_counter() - statement_start_time, error=error)
+
+                    # Failed statement rolls back the whole transaction
+                    if transaction:
+                        await database.rollback()
+                        written_tables.clear()
+
+                        results[:-1] = [{"status": "Error", "detail": ["Rolled back by failure of statement `%s`" % (len(results) - 1)]}] * (len(results) - 1)
+                        break
+
+            else:
+
+                if transaction:
+                    await database.commit()
+
+            stop_time = time.perf_counter()
+            execution_time = f"{stop_time - start_time:.7f}"
+
+        # Invalidating cached results of written tables
+        if result_cache is not None and not readonly:
+            for tables in written_tables:
+                result_cache.invalidate(tables)
+
+        status = "Error" if transaction and results[-1]["status"] == "Error" else "OK"
+        content = {"status": status, "execution_time_secs": execution_time, "pool_wait_time_secs": f"{wait_time:.7f}", "results": results}
+
+        await log_access(request.client, "Batch executed", status, status == "OK", duration=float(execution_time), statements=len(results))
+        response = encode_response(content, response_format, "rows", compression, config["encoding"]["compression_level"], config["encoding"]["min_compression_size"])
+
+        if metrics is not None:
+            metrics.observe_response("batch", len(response.body))
+
+        return response
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Batch executed", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    except overload_errors as error:
+        return await reject_overloaded(request.client, "Batch executed", error)
+
+    except aiosqlite.Error as error:
+        await log_access(request.client, "Batch executed", "SQLite exception", ok=False)
+        return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+    except Exception as error:
+        await log_access(request.client, "Batch executed", "Invalid exception", ok=False)
+        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+
+
+@application.websocket(config["database"]["route"] + "/ws")
+async def websocket_session_handler(websocket: fastapi.WebSocket) -> None:
+    """Route for WebSocket sessions, authenticated once and executing pipelined SQL queries.
+
+    Every message have to contain `id`, which is returned with its response, responses are sent in order of execution end.
+    Messages with `action` set to `begin` acquire dedicated connection for session transaction, it's released by `commit` or `rollback`.
+    Messages received while transaction is open are executed one by one in order of receiving.
+    """
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and websocket.client.host not in config["database"]["allowed_ips"]:
+        await log_access(websocket.client, "Session opened", "IP not allowed", ok=False)
+        return await websocket.close(code=1008)
+
+    await websocket.accept()
+
+    send_lock = asyncio.Lock()
+    pipeline_semaphore = asyncio.Semaphore(config["websocket"]["max_pipelined"])
+    pipeline_tasks = set()
+
+    # Session transaction connection and tables written in it
+    transaction = contextlib.AsyncExitStack()
+    transaction_database = None
+    transaction_tables = list()
+
+    async def send(message_id: str | int | None, content: dict[str, typing.Any]) -> None:
+        """Sends response tagged with request ID."""
+
+        try:
+            text = json.dumps({"id": message_id} | content, ensure_ascii=False, separators=(",", ":"), default=encode_json_value)
+
+        # Client still receives response to its request, if result can't be encoded
+        except (TypeError, ValueError) as error:
+            text = json.dumps({"id": message_id, "status": "Error", "detail": ["Unable to encode result: %s" % error]}, ensure_ascii=False, separators=(",", ":"))
+
+        async with send_lock:
+            await websocket.send_text(text)
+
+        if metrics is not None:
+            metrics.observe_response("websocket", len(text))
+
+    async def execute(message: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        """Executes query message, catching its errors."""
+
+        try:
+
+            # If session transaction is open
+            if transaction_database is not None:
+                start_time = time.perf_counter()
+
+                try:
+
+                    async with admission.admit():
+
+                        if message["single"]:
+                            result, tables = await execute_on_connection(transaction_database, message["query"], message.get("params", ()))
+                            transaction_tables.append(tables)
+
+                        # Script is executed statement by statement, because `executescript` commits open transaction first
+                        else:
+
+                            for statement in split_statements(message["query"]):
+                                result, tables = await execute_on_connection(transaction_database, statement)
+                                transaction_tables.append(tables)
+
+                            result = dict()
+
+                except aiosqlite.Error as error:
+
+                    if metrics is not None:
+                        metrics.observe_query("single" if message["single"] else "script", message["query"], "Error", time.perf_counter() - start_time, error=error)
+
+                    raise
+
+                if metrics is not None:
+                    metrics.observe_query("single" if message["single"] else "script", message["query"], "OK", time.perf_counter() - start_time, len(result.get("data") or ()))
+
+                return {"status": "OK", "execution_time_secs": f"{time.perf_counter() - start_time:.7f}"} | result
+
+            return await execute_query(message["query"], message.get("params", ()), message["single"])
+
+        except overload_errors as error:
+            return {"status": "Error", "detail": [overload_status(error)[1]]}
+
+        except aiosqlite.Error as error:
+            return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+        except Exception as error:
+            return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+
+    async def execute_pipelined(message: dict[str, typing.Any]) -> None:
+        """Executes query message concurrently with another ones and sends its response."""
+
+        try:
+            await send(message["id"], await execute(message))
+
+        finally:
+            pipeline_semaphore.release()
+
+    try:
+
+        # If password is required, first message have to contain it
+        if config["database"]["allowed_passwords"]:
+
+            if not isinstance(message := await websocket.receive_json(), dict) or message.get("password") not in config["database"]["allowed_passwords"]:
+                await log_access(websocket.client, "Session opened", "Invalid password", ok=False)
+
+                await send(message.get("id") if isinstance(message, dict) else None, {"status": "Error", "detail": ["Invalid password"]})
+                return await websocket.close(code=1008)
+
+            await send(message.get("id"), {"status": "OK"})
+
+        await log_access(websocket.client, "Session opened", "OK")
+
+        while True:
+
+            try:
+
+                # Open transaction holds the writer, so it's waited for the next message only for `transaction_idle_timeout` seconds
+                idle_timeout = config["websocket"]["transaction_idle_timeout"] if transaction_database is not None else 0.0
+                message = await asyncio.wait_for(websocket.receive_json(), idle_timeout or None)
+
+            except json.decoder.JSONDecodeError:
+                await send(None, {"status": "Error", "detail": ["Expected JSON message"]})
+                continue
+
+            # Rolling back idle transaction and returning connection to pool
+            except asyncio.TimeoutError:
+                await transaction.aclose()
+                transaction_database = None
+                transaction_tables.clear()
+
+                await log_access(websocket.client, "Session transaction rolled back", "Idle timeout", ok=False)
+                await send(None, {"status": "Error", "detail": ["Transaction was rolled back after `%s` sec(s) of inactivity" % config["websocket"]["transaction_idle_timeout"]]})
+                continue
+
+            # If message is not an object
+            if not isinstance(message, dict):
+                await send(None, {"status": "Error", "detail": ["Expected JSON object message"]})
+                continue
+
+            # If client exceeded allowed requests rate
+            if not rate_limiter.allow(websocket.client.host):
+                await send(message.get("id"), {"status": "Error", "detail": ["Too many requests, retry after `%.2f` sec(s)" % rate_limiter.retry_after(websocket.client.host)]})
+                continue
+
+            # Params validation
+            if validation_errors := (session_query_schema if message.get("action", "query") == "query" else session_control_schema).validate(message):
+                await send(message.get("id"), {"status": "Error", "detail": validation_errors})
+                continue
+
+            # If query params were received for SQL script
+            if message.get("action", "query") == "query" and not message["single"] and "params" in message:
+                await send(message["id"], {"status": "Error", "detail": ["Param `params` can only be used with `single` queries"]})
+                continue
+
+            # If session transaction have to be opened
+            if message.get("action") == "begin":
+
+                if transaction_database is not None:
+                    await send(message["id"], {"status": "Error", "detail": ["Transaction is already open"]})
+                    continue
+
+                try:
+                    transaction_database, wait_time = await transaction.enter_async_context(pool.acquire())
+                    await transaction_database.execute("BEGIN;")
+
+                except (PoolTimeoutError, aiosqlite.Error) as error:
+                    await transaction.aclose()
+                    transaction_database = None
+
+                    await send(message["id"], {"status": "Error", "detail": ["Unable to begin transaction: %s" % error]})
+                    continue
+
+                await send(message["id"], {"status": "OK", "pool_wait_time_secs": f"{wait_time:.7f}"})
+
+            # If session transaction have to be finished
+            elif message.get("action") in ["commit", "rollback"]:
+
+                if transaction_database is None:
+                    await send(message["id"], {"status": "Error", "detail": ["Transaction is not open"]})
+                    continue
+
+                try:
+
+                    if message["action"] == "commit":
+                        await transaction_database.commit()
+
+                        # Invalidating cached results of tables written in transaction
+                        if result_cache is not None:
+                            for tables in transaction_tables:
+                                result_cache.invalidate(tables)
+
+                    content = {"status": "OK"}
+
+                except aiosqlite.Error as error:
+                    content = {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+                # Returning connection to pool, rolling back not committed changes
+                await transaction.aclose()
+                transaction_database = None
+                transaction_tables.clear()
+
+                await send(message["id"], content)
+
+            # Messages of open transaction are executed in order of receiving
+            elif transaction_database is not None:
+                await send(message["id"], await execute(message))
+
+            # Pipelining query, limiting count of queries executed at once
+            else:
+                await pipeline_semaphore.acquire()
+
+                pipeline_tasks.add(task := asyncio.create_task(execute_pipelined(message)))
+                task.add_done_callback(pipeline_tasks.discard)
+
+    except fastapi.WebSocketDisconnect:
+        await log_access(websocket.client, "Session closed", "OK")
+
+    finally:
+
+        # Cancelling queries of closed session
+        for task in list(pipeline_tasks):
+            task.cancel()
+
+        # Returning transaction connection to pool
+        await transaction.aclose()
+
+
+@application.post(config["database"]["route"] + "/shards")
+async def execute_sharded_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for process SQL queries on named databases, routed to shard by key or executed on all shards."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Shards accessed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Shards accessed")) is not None:
+        return rejection
+
+    try:
+
+        # Getting request body in JSON format
+        body = await request.json()
+
+        # Params validation
+        if validation_errors := shards_body_schema.validate(body):
+            await log_access(request.client, "Shards accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": validation_errors}
+
+        # If query params were received for SQL script
+        if not body["single"] and "params" in body:
+            await log_access(request.client, "Shards accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["Param `params` can only be used with `single` queries"]}
+
+        # If order items aren't strings
+        if not all(isinstance(item, str) for item in body.get("order_by", list())):
+            await log_access(request.client, "Shards accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["Param `order_by` have to be list of `column [ASC|DESC]` strings"]}
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and body["password"] not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Shards accessed", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+        # If named database isn't configured
+        if (sharded_database := sharded_databases.get(body["database"])) is None:
+            await log_access(request.client, "Shards accessed", "Unknown database", ok=False)
+            return {"status": "Error", "detail": ["Database `%s` is not configured" % body["database"]]}
+
+        # Rows added without key would be added to every shard
+        if body.get("key") is None and adds_rows(body["query"], body["single"]):
+            await log_access(request.client, "Shards accessed", "Validation failed", ok=False)
+            return rejection_response(400, "Param `key` is required for queries adding rows, row have to be stored by one shard")
+
+        # Response encoding negotiation
+        response_format = negotiate_format(body.get("format"), request.headers.get("accept", ""))
+        compression = negotiate_compression(request.headers.get("accept-encoding", ""))
+
+        # If MessagePack was requested but isn't installed
+        if response_format == "msgpack" and msgpack is None:
+            await log_access(request.client, "Shards accessed", "Validation failed", ok=False)
+            return {"status": "Error", "detail": ["MessagePack format is not supported by server"]}
+
+        start_time = time.perf_counter()
+
+        try:
+
+            # Waiting for free execution slot, fanned out query takes one slot
+            async with admission.admit():
+                content = await sharded_database.execute(body["query"], body.get("params", ()), body["single"], body.get("key"), body.get("order_by"), body.get("limit"))
+
+        except Exception as error:
+
+            if metrics is not None:
+                metrics.observe_query("shards", body["query"], "Error", time.perf_counter() - start_time, error=error)
+
+            raise
+
+        if metrics is not None:
+            metrics.observe_query("shards", body["query"], "OK", time.perf_counter() - start_time, len(content.get("data") or ()))
+
+        await log_access(
+            request.client,
+            "Shards accessed",
+            "OK",
+            duration=float(content["execution_time_secs"]),
+            fingerprint=fingerprint_query(body["query"]),
+            database=body["database"],
+            shards=content["shards"],
+        )
+        response = encode_response(content, response_format, body.get("layout", "rows"), compression, config["encoding"]["compression_level"], config["encoding"]["min_compression_size"])
+
+        if metrics is not None:
+            metrics.observe_response("shards", len(response.body))
+
+        return response
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Shards accessed", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    except ShardingError as error:
+        await log_access(request.client, "Shards accessed", "Merge exception", ok=False)
+        return {"status": "Error", "detail": [str(error)]}
+
+    except overload_errors as error:
+        return await reject_overloaded(request.client, "Shards accessed", error)
+
+    except aiosqlite.Error as error:
+        await log_access(request.client, "Shards accessed", "SQLite exception", ok=False)
+        return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+    except Exception as error:
+        await log_access(request.client, "Shards accessed", "Invalid exception", ok=False)
+        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+
+
+@application.get(config["database"]["route"] + "/changes")
+async def changes_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for subscribing to changes of captured tables as server-sent events, params are received in URL."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Changes subscribed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Changes subscribed")) is not None:
+        return rejection
+
+    # Reconnecting `EventSource` sends identifier of the last received change in header
+    params = dict(request.query_params)
+    if "last-event-id" in request.headers:
+        params["since"] = request.headers["last-event-id"]
+
+    # Params validation
+    if validation_errors := changes_params_schema.validate(params):
+        await log_access(request.client, "Changes subscribed", "Validation failed", ok=False)
+        return {"status": "Error", "detail": validation_errors}
+
+    # If password is required and password is invalid
+    if config["database"]["allowed_passwords"] and params["password"] not in config["database"]["allowed_passwords"]:
+        await log_access(request.client, "Changes subscribed", "Invalid password", ok=False)
+        return {"status": "Error", "detail": ["Invalid password"]}
+
+    # If change feed is disabled
+    if change_feed is None:
+        await log_access(request.client, "Changes subscribed", "Disabled", ok=False)
+        return {"status": "Error", "detail": ["Change feed is disabled"]}
+
+    tables = {table.strip() for table in params["tables"].split(",") if table.strip()} if params.get("tables") else None
+
+    # If changes of some tables aren't captured
+    if tables and (unknown_tables := sorted(tables - set(change_feed.tables))):
+        await log_access(request.client, "Changes subscribed", "Validation failed", ok=False)
+        return {"status": "Error", "detail": ["Changes of table `%s` aren't captured" % table for table in unknown_tables]}
+
+    await log_access(request.client, "Changes subscribed", "OK", tables=sorted(tables or change_feed.tables))
+
+    stream = stream_changes(change_feed.subscribe(tables), int(params["since"]) if "since" in params else None)
+    return fastapi.responses.StreamingResponse(stream, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@application.post(config["database"]["route"] + "/stats")
+async def statistics_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for retrieving database service statistics."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Statistics accessed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Statistics accessed")) is not None:
+        return rejection
+
+    try:
+
+        # Getting request body in JSON format
+        body = await request.json()
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and (not isinstance(body, dict) or body.get("password")) not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Statistics accessed", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Statistics accessed", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    await log_access(request.client, "Statistics accessed", "OK")
+    return {
+        "status": "OK",
+        "statement_cache": pool.statement_cache_statistics(),
+        "limits": admission.statistics() | {"rate_limited": rate_limiter.rejected, "query_timeouts": pool.query_timeouts},
+        "log_records_dropped": log_writer.dropped,
+    } | ({"result_cache": result_cache.statistics()} if result_cache is not None else dict())
+
+
+@application.post(config["database"]["route"] + "/slow_queries")
+async def slow_queries_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for retrieving slow queries log, their plans and indexes suggestions for the worst ones."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Slow queries accessed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Slow queries accessed")) is not None:
+        return rejection
+
+    try:
+
+        # Getting request body in JSON format
+        body = await request.json()
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and (not isinstance(body, dict) or body.get("password")) not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Slow queries accessed", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Slow queries accessed", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    # If slow queries log is disabled
+    if slow_query_log is None:
+        await log_access(request.client, "Slow queries accessed", "Disabled", ok=False)
+        return {"status": "Error", "detail": ["Slow queries log is disabled"]}
+
+    await log_access(request.client, "Slow queries accessed", "OK")
+    return {"status": "OK", "threshold_secs": slow_query_log.threshold, "worst": slow_query_log.worst(config["slow_queries"]["worst_count"]), "entries": list(slow_query_log.entries)}
+
+
+@application.post(config["database"]["route"] + "/backup")
+async def backup_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for streaming online backup of database or of named database shard."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Backup requested", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If client exceeded allowed requests rate
+    if (rejection := await reject_rate_limited(request.client, "Backup requested")) is not None:
+        return rejection
+
+    try:
+
+        # Getting request body in JSON format
+        body = await request.json()
+
+        # Params validation
+        if validation_errors := backup_body_schema.validate(body):
+            await log_access(request.client, "Backup requested", "Validation failed", ok=False)
+            return {"status": "Error", "detail": validation_errors}
+
+        # If password is required and password is invalid
+        if config["database"]["allowed_passwords"] and body["password"] not in config["database"]["allowed_passwords"]:
+            await log_access(request.client, "Backup requested", "Invalid password", ok=False)
+            return {"status": "Error", "detail": ["Invalid password"]}
+
+        # If named database or its shard isn't configured
+        if "database" in body and ((sharded_database := sharded_databases.get(body["database"])) is None or body.get("shard", 0) >= len(sharded_database.pools)):
+            await log_access(request.client, "Backup requested", "Unknown database", ok=False)
+            return {"status": "Error", "detail": ["Database `%s` shard `%s` is not configured" % (body["database"], body.get("shard", 0))]}
+
+        # If another backup is being made, backups aren't made at once to save disk space
+        if backup_lock.locked():
+            await log_access(request.client, "Backup requested", "Already running", ok=False)
+            return {"status": "Error", "detail": ["Another backup is being made, retry later"]}
+
+        backup_pool = sharded_database.pools[body.get("shard", 0)] if "database" in body else pool
+
+        # Backup copy is written next to database file and removed after it was sent
+        descriptor, backup_path = tempfile.mkstemp(prefix=os.path.basename(backup_pool.database_path) + ".", suffix=".backup", dir=os.path.dirname(os.path.abspath(backup_pool.database_path)))
+        os.close(descriptor)
+
+        start_time = time.perf_counter()
+        response = None
+
+        try:
+
+            async with backup_lock:
+                await backup_pool.backup(backup_path, config["backup"]["pages"], config["backup"]["sleep"], config["backup"]["max_restarts"])
+
+            await log_access(request.client, "Backup requested", "OK", duration=time.perf_counter() - start_time, size=os.path.getsize(backup_path))
+
+            # Copy is removed after it was sent, or after response was finished without reading it, if client disconnected early
+            filename = "%s-%s.db" % (os.path.splitext(os.path.basename(backup_pool.database_path))[0], time.strftime("%Y%m%d-%H%M%S"))
+            response = fastapi.responses.StreamingResponse(
+                read_file_chunks(backup_path, config["backup"]["chunk_size"], remove=True),
+                media_type="application/vnd.sqlite3",
+                headers={"Content-Disposition": 'attachment; filename="%s"' % filename, "Content-Length": str(os.path.getsize(backup_path))},
+                background=starlette.background.BackgroundTask(remove_file, backup_path),
+            )
+
+            return response
+
+        finally:
+
+            # If backup failed or response wasn't created
+            if response is None:
+                remove_file(backup_path)
+
+    except json.decoder.JSONDecodeError:
+        await log_access(request.client, "Backup requested", "Body parse exception", ok=False)
+        return {"status": "Error", "detail": ["Expected JSON in request body"]}
+
+    except aiosqlite.Error as error:
+        await log_access(request.client, "Backup requested", "SQLite exception", ok=False)
+        return {"status": "Error", "detail": ["SQLite error: %s" % error]}
+
+    except Exception as error:
+        await log_access(request.client, "Backup requested", "Invalid exception", ok=False)
+        return {"status": "Error", "detail": ["Unexpected exception occurred: %s" % error]}
+
+
+@application.get(config["database"]["route"] + "/metrics")
+async def metrics_handler(request: fastapi.Request) -> fastapi.Response:
+    """Route for retrieving database service metrics in Prometheus text format."""
+
+    # If allowed IP list is not empty and request IP is not allowed
+    if config["database"]["allowed_ips"] and request.client.host not in config["database"]["allowed_ips"]:
+        await log_access(request.client, "Metrics accessed", "IP not allowed", ok=False)
+        return {"status": "Error", "detail": ["Your IP are not contains in whitelist"]}
+
+    # If password is required, scrapers send it as bearer token or `password` URL param
+    allowed_passwords = config["database"]["allowed_passwords"]
+    if allowed_passwords and request.headers.get("authorization", "").removeprefix("Bearer ") not in allowed_passwords and request.query_params.get("password") not in allowed_passwords:
+        await log_access(request.client, "Metrics accessed", "Invalid password", ok=False)
+        return fastapi.responses.PlainTextResponse("Invalid password\n", status_code=401)
+
+    # If metrics are disabled
+    if metrics is None:
+        return fastapi.responses.PlainTextResponse("Metrics are disabled\n", status_code=404)
+
+    counters, gauges = collect_service_metrics()
+
+    # Aggregating current metrics with saved metrics of another workers
+    if is_worker:
+        combined_metrics, counters, gauges = combine_snapshots([metrics.snapshot(counters, gauges), *read_worker_snapshots(os.environ[metrics_directory_environment_variable])])
+        return fastapi.responses.PlainTextResponse(combined_metrics.render(counters, gauges | {"database_workers": workers_count}), media_type="text/plain; version=0.0.4")
+
+    return fastapi.responses.PlainTextResponse(metrics.render(counters, gauges), media_type="text/plain; version=0.0.4")
+
+
+application.add_event_handler("startup", startup)
+application.add_event_handler("shutdown", shutdown)
+
+if __name__ == "__main__":
+
+    # If server have to be run by several worker processes
+    if workers_count > 1:
+
+        # Workers skip preparation and aggregate metrics through shared directory
+        asyncio.run(prepare_workers())
+        os.environ[worker_environment_variable] = "1"
+        os.environ[metrics_directory_environment_variable] = metrics_directory = tempfile.mkdtemp(prefix="database-metrics-")
+
+        try:
+            uvicorn.run(
+                "main:application",
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                workers=workers_count,
+                host=config["database"]["host"],
+                port=config["database"]["port"],
+                log_level="critical",
+            )
+
+        finally:
+            shutil.rmtree(metrics_directory, ignore_errors=True)
+
+    else:
+        uvicorn.run(app=application, host=config["database"]["host"], port=config["database"]["port"], log_level="critical")
@@ -0,0 +1,218 @@
+import bisect
+import typing
+import aiosqlite
+import collections
+
+# Local imports
+from misc import *
+
+# Global and static variables, constants
+duration_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+wait_buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+busy_error_messages = ("database is locked", "database table is locked", "database is busy")
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def escape_label(value: str) -> str:
+    """Escapes Prometheus label value."""
+
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace("\"", r"\"")
+
+
+def format_series(name: str, labels: dict[str, str]) -> str:
+    """Formats Prometheus series name with labels set."""
+
+    # If series has no labels
+    if not labels:
+        return name
+
+    return "%s{%s}" % (name, ",".join('%s="%s"' % (label, escape_label(value)) for label, value in labels.items()))
+
+
+def combine_snapshots(snapshots: list[dict[str, typing.Any]]) -> tuple["Metrics", dict[str, int | float], dict[str, int | float]]:
+    """Sums metrics snapshots of several processes. Retrieves combined metrics, service counters and gauges."""
+
+    metrics = Metrics()
+    counters = collections.Counter()
+    gauges = collections.Counter()
+
+    for snapshot in snapshots:
+        metrics.merge(snapshot)
+        counters.update(snapshot["counters"])
+        gauges.update(snapshot["gauges"])
+
+    return metrics, dict(counters), dict(gauges)
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class Histogram:
+    """Histogram with preallocated buckets, observation only increments counters."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        """Allocates bucket counters for given upper bounds."""
+
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Counts value in its bucket."""
+
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: list[int], total: float, count: int) -> None:
+        """Adds counters of another histogram with the same buckets."""
+
+        for index, bucket_count in enumerate(counts):
+            self.counts[index] += bucket_count
+
+        self.sum += total
+        self.count += count
+
+    def render(self, name: str, labels: dict[str, str]) -> list[str]:
+        """Retrieves Prometheus lines of cumulative buckets, sum and count."""
+
+        lines = list()
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            cumulative += count
+            lines.append("%s %s" % (format_series(name + "_bucket", labels | {"le": str(bound)}), cumulative))
+
+        lines.append("%s %s" % (format_series(name + "_sum", labels), self.sum))
+        lines.append("%s %s" % (format_series(name + "_count", labels), self.count))
+
+        return lines
+
+
+class Metrics:
+    """In-process registry of queries metrics rendered in Prometheus text format.
+
+    Queries are labeled by execution mode, status and fingerprint, fingerprints above `max_fingerprints` are counted as `other`.
+    """
+
+    def __init__(self, max_fingerprints: int = 1000, max_fingerprint_length: int = 256) -> None:
+        """Creates empty metrics."""
+
+        self.max_fingerprints = max_fingerprints
+        self.max_fingerprint_length = max_fingerprint_length
+        self.fingerprints = set()
+
+        self.durations = dict()
+        self.rows = collections.Counter()
+        self.response_bytes = collections.Counter()
+        self.pool_wait = Histogram(wait_buckets)
+        self.busy_errors = 0
+
+    def fingerprint(self, query: str) -> str:
+        """Retrieves bounded fingerprint label of SQL query."""
+
+        fingerprint = fingerprint_query(query)[:self.max_fingerprint_length]
+
+        # If there are too many distinct fingerprints already
+        if fingerprint not in self.fingerprints:
+
+            if len(self.fingerprints) >= self.max_fingerprints:
+                return "other"
+
+            self.fingerprints.add(fingerprint)
+
+        return fingerprint
+
+    def observe_query(self, mode: str, query: str, status: str, duration: float, rows: int = 0, error: Exception | None = None) -> None:
+        """Records executed query duration and count of returned rows."""
+
+        fingerprint = self.fingerprint(query)
+
+        if (histogram := self.durations.get(key := (mode, status, fingerprint))) is None:
+            histogram = self.durations[key] = Histogram(duration_buckets)
+
+        histogram.observe(duration)
+
+        if rows:
+            self.rows[(mode, fingerprint)] += rows
+
+        # If query failed, because database was locked by another connection
+        if isinstance(error, aiosqlite.OperationalError) and str(error).startswith(busy_error_messages):
+            self.busy_errors += 1
+
+    def observe_response(self, route: str, size: int) -> None:
+        """Records size of sent response."""
+
+        self.response_bytes[route] += size
+
+    async def observe_stream(self, route: str, chunks: typing.AsyncIterator[bytes]) -> typing.AsyncIterator[bytes]:
+        """Yields chunks of streamed response recording their size."""
+
+        async for chunk in chunks:
+            self.response_bytes[route] += len(chunk)
+            yield chunk
+
+    def snapshot(self, counters: dict[str, int | float] | None = None, gauges: dict[str, int | float] | None = None) -> dict[str, typing.Any]:
+        """Retrieves JSON serializable state of metrics and given service counters and gauges."""
+
+        return {
+            "durations": [[mode, status, fingerprint, histogram.counts, histogram.sum, histogram.count] for (mode, status, fingerprint), histogram in self.durations.items()],
+            "rows": [[mode, fingerprint, rows] for (mode, fingerprint), rows in self.rows.items()],
+            "response_bytes": dict(self.response_bytes),
+            "pool_wait": [self.pool_wait.counts, self.pool_wait.sum, self.pool_wait.count],
+            "busy_errors": self.busy_errors,
+            "counters": counters or dict(),
+            "gauges": gauges or dict(),
+        }
+
+    def merge(self, snapshot: dict[str, typing.Any]) -> None:
+        """Adds metrics snapshot of another process."""
+
+        for mode, status, fingerprint, counts, total, count in snapshot["durations"]:
+
+            if (histogram := self.durations.get(key := (mode, status, fingerprint))) is None:
+                histogram = self.durations[key] = Histogram(duration_buckets)
+
+            histogram.merge(counts, total, count)
+
+        for mode, fingerprint, rows in snapshot["rows"]:
+            self.rows[(mode, fingerprint)] += rows
+
+        self.response_bytes.update(snapshot["response_bytes"])
+        self.pool_wait.merge(*snapshot["pool_wait"])
+        self.busy_errors += snapshot["busy_errors"]
+
+    def render(self, counters: dict[str, int | float] | None = None, gauges: dict[str, int | float] | None = None) -> str:
+        """Retrieves all of the metrics and given service counters and gauges in Prometheus text format."""
+
+        lines = [
+            "# HELP database_query_duration_seconds Duration of queries execution.",
+            "# TYPE database_query_duration_seconds histogram",
+        ]
+
+        for (mode, status, fingerprint), histogram in list(self.durations.items()):
+            lines.extend(histogram.render("database_query_duration_seconds", {"mode": mode, "status": status, "fingerprint": fingerprint}))
+
+        lines.extend(["# HELP database_rows_returned_total Count of rows returned by queries.", "# TYPE database_rows_returned_total counter"])
+        lines.extend("%s %s" % (format_series("database_rows_returned_total", {"mode": mode, "fingerprint": fingerprint}), rows) for (mode, fingerprint), rows in list(self.rows.items()))
+
+        lines.extend(["# HELP database_response_bytes_total Size of sent responses.", "# TYPE database_response_bytes_total counter"])
+        lines.extend("%s %s" % (format_series("database_response_bytes_total", {"route": route}), size) for route, size in list(self.response_bytes.items()))
+
+        lines.extend(["# HELP database_pool_wait_seconds Time spent waiting for pool connection.", "# TYPE database_pool_wait_seconds histogram"])
+        lines.extend(self.pool_wait.render("database_pool_wait_seconds", dict()))
+
+        lines.extend(["# HELP database_busy_errors_total Count of queries failed, because database was locked.", "# TYPE database_busy_errors_total counter"])
+        lines.append("database_busy_errors_total %s" % self.busy_errors)
+
+        # Service counters and gauges collected elsewhere
+        for metric_type, values in [("counter", counters or dict()), ("gauge", gauges or dict())]:
+            for name, value in values.items():
+                lines.extend(["# TYPE %s %s" % (name, metric_type), "%s %s" % (name, value)])
+
+        return "\n".join(lines) + "\n"
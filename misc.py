@@ -1,13 +1,25 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
 import toml
+import queue
+import random
 import typing
+import sqlite3
 import asyncio
 import colorama
 import datetime
+import functools
 import aiosqlite
+import threading
+import contextlib
 
 # Global and static variables, constants
 log_formatations_map = {
-    r"%now": lambda: datetime.datetime.now().strftime(r"%Y-%m-%d %H:%M:%S"),
+    r"%now": lambda timestamp: datetime.datetime.fromtimestamp(timestamp).strftime(r"%Y-%m-%d %H:%M:%S"),
 
     r"%lred": colorama.Fore.LIGHTRED_EX,
     r"%lgreen": colorama.Fore.GREEN,
@@ -30,6 +42,14 @@ log_formatations_map = {
     r"%reset": colorama.Fore.RESET
 }
 
+# Literals of SQL queries, replaced by fingerprinting
+fingerprint_pattern = re.compile(r"'(?:[^']|'')*'|\b[xX]'[0-9a-fA-F]*'|(?<![\w$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|\s+")
+fingerprint_lists_pattern = re.compile(r"\?(?:\s*,\s*\?)+")
+fingerprint_rows_pattern = re.compile(r"\(\?\+?\)(?:\s*,\s*\(\?\+?\))+")
+
+# Formatations are substituted in one pass, longer ones are matched first
+log_formatation_pattern = re.compile("|".join([re.escape(formatation) for formatation in sorted(log_formatations_map, key=len, reverse=True)]))
+
 
 # ==------------------------------------------------------------== #
 # Functions                                                        #
@@ -48,43 +68,337 @@ def read_toml_config(filename: str) -> dict[str, typing.Any]:
     return config
 
 
+def split_statements(script: str) -> list[str]:
+    """Splits SQL script into statements, semicolons inside literals and identifiers don't split it."""
+
+    statements, statement = list(), ""
+    for part in script.split(";"):
+        statement += part + ";"
+
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ""
+
+    return statements
+
+
+def deterministic(function: callable) -> callable:
+    """Marks SQL function, which always retrieves the same result for the same arguments, as deterministic."""
+
+    function.deterministic = True
+    return function
+
+
+def sql_function_name(function: callable) -> str:
+    """Retrieves SQL name of function or aggregate class, `StandardDeviation` class is named `STANDARD_DEVIATION`."""
+
+    # If function is scalar one, its name is kept as it is
+    if not isinstance(function, type):
+        return function.__name__.upper()
+
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", function.__name__).upper()
+
+
+def sql_function_annotations(function: callable) -> dict[str, typing.Any]:
+    """Retrieves types annotations of function or of aggregate class `step` arguments and `finalize` return value."""
+
+    # If function is scalar one
+    if not isinstance(function, type):
+        return function.__annotations__
+
+    annotations = {name: annotation for name, annotation in function.step.__annotations__.items() if name != "return"}
+    if "return" in function.finalize.__annotations__:
+        annotations["return"] = function.finalize.__annotations__["return"]
+
+    return annotations
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint_query(query: str) -> str:
+    """Retrieves SQL query fingerprint with stripped literals and collapsed whitespaces and lists of values."""
+
+    fingerprint = fingerprint_pattern.sub(lambda match: " " if match.group(0).isspace() else "?", query).strip().rstrip(";").rstrip()
+    return fingerprint_rows_pattern.sub("(?+)+", fingerprint_lists_pattern.sub("?+", fingerprint))
+
+
+def format_log_message(message: str, timestamp: float, colored: bool = True) -> str:
+    """Substitutes log formatations, colors are deleted if message is not colored."""
+
+    def substitute(match: re.Match) -> str:
+        """Retrieves value of matched formatation."""
+
+        # If formatation is a callable object
+        if callable(formatation := log_formatations_map[match.group(0)]):
+            return formatation(timestamp)
+
+        return formatation if colored else ""
+
+    return log_formatation_pattern.sub(substitute, message)
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class LogWriter:
+    """Writes log records from bounded queue in background thread, so logging never blocks event loop.
+
+    Records are dropped if queue is full, access records are sampled by `sample_rate`.
+    """
+
+    def __init__(self, output: str = "console", queue_size: int = 10000, sample_rate: float = 1.0) -> None:
+        """Stores writer settings, thread is started with the first record."""
+
+        self.configure(output, queue_size, sample_rate)
+
+        self.thread = None
+        self.dropped = 0
+
+    def configure(self, output: str, queue_size: int, sample_rate: float) -> None:
+        """Changes writer settings, have to be called before the first record."""
+
+        self.output = output
+        self.sample_rate = sample_rate
+        self.records = queue.Queue(maxsize=queue_size)
+
+    def put(self, record: tuple[float, str, str, bool, dict[str, typing.Any]], sampled: bool = False) -> None:
+        """Queues record to write without waiting."""
+
+        # If sampled record wasn't chosen
+        if sampled and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+            self.thread.start()
+
+        try:
+            self.records.put_nowait(record)
+
+        except queue.Full:
+            self.dropped += 1
+
+    def format(self, record: tuple[float, str, str, bool, dict[str, typing.Any]]) -> str:
+        """Formats record as colored console line or JSON line."""
+
+        timestamp, level, message, autoreset, fields = record
+
+        # If records are written as JSON lines
+        if self.output == "json":
+            entry = {"time": datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"), "level": level}
+            return json.dumps(entry | (fields or {"message": format_log_message(message, timestamp, False)}), ensure_ascii=False, default=str)
+
+        return format_log_message(message, timestamp) + (log_formatations_map[r"%reset"] if autoreset else "")
+
+    def run(self) -> None:
+        """Writes queued records, all of the records available at once are written together."""
+
+        stopped = False
+        while not stopped:
+            records = [self.records.get()]
+
+            # Taking all of the queued records
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    records.append(self.records.get_nowait())
+
+            # If stop record was received
+            if stopped := None in records:
+                records = records[:records.index(None)]
+
+            if records:
+                sys.stdout.write("\n".join([self.format(record) for record in records]) + "\n")
+                sys.stdout.flush()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """Writes remaining records and stops the thread."""
+
+        if self.thread is not None:
+
+            with contextlib.suppress(queue.Full):
+                self.records.put(None, timeout=timeout)
+
+            self.thread.join(timeout)
+            self.thread = None
+
+
+# Global log writer
+log_writer = LogWriter()
+
+
 # ==------------------------------------------------------------== #
 # Async function                                                   #
 # ==------------------------------------------------------------== #
-async def log(message: str, autoreset: bool = True) -> None:
-    """Prints formated log message."""
+async def log(message: str, autoreset: bool = True, level: str = "INFO") -> None:
+    """Queues formated log message to write it in background."""
 
-    finally_message = message
-    for formatation in log_formatations_map:
+    log_writer.put((time.time(), level, message, autoreset, None))
+
+
+async def log_access(client: typing.Any, event: str, status: str, ok: bool = True, **fields: typing.Any) -> None:
+    """Queues sampled log record of client request with its structured fields."""
+
+    message = rf"%magenta[%now] %greenINFO%reset:{' ' * 2}{client.host}:{client.port} - %lwhite'{event}' %{'green' if ok else 'red'}{status}"
+    log_writer.put((time.time(), "INFO", message, True, {"client": f"{client.host}:{client.port}", "event": event, "status": status} | fields), sampled=True)
 
-        # If formatation is a callable object
-        if callable(log_formatations_map[formatation]):
-            finally_message = finally_message.replace(formatation, log_formatations_map[formatation]())
 
-        # If formatation is a predefined value
-        else:
-            finally_message = finally_message.replace(formatation, log_formatations_map[formatation])
+@functools.lru_cache(maxsize=None)
+def sqlite_connection_factory(*functions: callable) -> type[sqlite3.Connection]:
+    """Builds `sqlite3` connection class registrating aggregate classes of functions list, when connection is opened.
 
-        await asyncio.sleep(0)
+    `aiosqlite` has no method to registrate aggregates, but it passes `factory` argument to `sqlite3.connect` in connection thread.
+    """
 
-    if autoreset:
-        finally_message += log_formatations_map[r"%reset"]
+    aggregates = [function for function in functions if isinstance(function, type)]
 
-    print(finally_message)
+    class Connection(sqlite3.Connection):
+        """SQLite connection with registrated aggregate and window functions."""
+
+        def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+            """Opens connection and registrates aggregate classes, the ones with `inverse` method can be used as window functions too."""
+
+            super().__init__(*args, **kwargs)
+
+            for aggregate in aggregates:
+                (self.create_window_function if hasattr(aggregate, "inverse") else self.create_aggregate)(sql_function_name(aggregate), aggregate.step.__code__.co_argcount - 1, aggregate)
+
+    return Connection
 
 
 async def registrate_sqlite_functions(database: aiosqlite.Connection, *functions: callable) -> None:
-    """Registrates list of functions to make it callable from SQL syntax."""
+    """Registrates list of functions to make it callable from SQL syntax, checks annotations of aggregate classes registrated by connection factory."""
 
     for function in functions:
 
         # Deleting return value from function types annotations if it's exists
-        if "return" in (function_annotations := function.__annotations__.copy()):
+        if "return" in (function_annotations := sql_function_annotations(function).copy()):
             del function_annotations["return"]
 
+        # Aggregate classes receive arguments by `step` method
+        arguments_count = function.step.__code__.co_argcount - 1 if isinstance(function, type) else function.__code__.co_argcount
+
         # If not all of the function arguments have types annotations
-        if function.__code__.co_argcount != len(function_annotations):
+        if arguments_count != len(function_annotations):
             raise Exception(f"All `{function.__name__}` function arguments have to be annotated")
 
-        # SQLite function registration
-        await database.create_function(function.__name__.upper(), len(function_annotations), function)
+        # Aggregate classes are registrated by connection opened with `sqlite_connection_factory` class
+        if isinstance(function, type):
+            continue
+
+        # SQLite function registration, deterministic functions can be used in indexes and generated columns
+        await database.create_function(sql_function_name(function), arguments_count, function, deterministic=getattr(function, "deterministic", False))
+
+
+async def read_lines(stream: typing.AsyncIterator[bytes], keep_empty: bool = False) -> typing.AsyncIterator[str]:
+    """Splits streamed bytes into text lines without buffering the whole stream, empty lines are skipped unless `keep_empty` is set."""
+
+    buffer = b""
+    async for chunk in stream:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+
+        for line in lines:
+            if (line := line.decode("utf-8").rstrip("\r")) or keep_empty:
+                yield line
+
+    if line := buffer.decode("utf-8").rstrip("\r"):
+        yield line
+
+
+async def read_ndjson_rows(stream: typing.AsyncIterator[bytes]) -> typing.AsyncIterator[list | dict]:
+    """Parses streamed NDJSON rows, every line have to be JSON array or object."""
+
+    async for line in read_lines(stream):
+        yield json.loads(line)
+
+
+async def read_csv_rows(stream: typing.AsyncIterator[bytes], header: bool = False) -> typing.AsyncIterator[list | dict]:
+    """Parses streamed CSV rows, rows are dictionaries if first line is a header."""
+
+    columns = None
+    record, quotes = None, 0
+
+    async for line in read_lines(stream, keep_empty=True):
+        record = line if record is None else record + "\n" + line
+        quotes += line.count('"')
+
+        # Quoted field containing line breaks continues on the next lines, until its quotes are closed
+        if quotes % 2:
+            continue
+
+        record, quotes, line = None, 0, record
+
+        # If record is empty line
+        if not line:
+            continue
+
+        row = next(csv.reader([line]))
+
+        # If first line contains column names
+        if header and columns is None:
+            columns = row
+            continue
+
+        yield dict(zip(columns, row)) if columns else row
+
+    # Last record with not closed quotes
+    if record:
+        row = next(csv.reader([record]))
+        yield dict(zip(columns, row)) if columns else row
+
+
+async def prepend(item: typing.Any, items: typing.AsyncIterator) -> typing.AsyncIterator:
+    """Yields item before all of the async iterator items."""
+
+    yield item
+
+    async for item in items:
+        yield item
+
+
+def remove_file(path: str) -> None:
+    """Removes file if it still exists."""
+
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+async def read_file_chunks(path: str, size: int, remove: bool = False) -> typing.AsyncIterator[bytes]:
+    """Yields file content by chunks read in separate thread, file is removed after reading if `remove` is set."""
+
+    try:
+
+        with open(path, "rb") as file:
+            while chunk := await asyncio.to_thread(file.read, size):
+                yield chunk
+
+    finally:
+
+        if remove:
+            remove_file(path)
+
+
+async def iterate_chunks(items: typing.Iterable | typing.AsyncIterable, size: int) -> typing.AsyncIterator[list]:
+    """Groups items of sync or async iterable into lists of given size."""
+
+    chunk = list()
+
+    # If items are received asynchronously
+    if hasattr(items, "__aiter__"):
+
+        async for item in items:
+            chunk.append(item)
+
+            if len(chunk) >= size:
+                yield chunk
+                chunk = list()
+
+    else:
+
+        for item in items:
+            chunk.append(item)
+
+            if len(chunk) >= size:
+                yield chunk
+                chunk = list()
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,508 @@
+import re
+import time
+import typing
+import sqlite3
+import asyncio
+import aiosqlite
+import contextlib
+import collections
+
+# Local imports
+from misc import *
+from metrics import *
+from workers import *
+
+# Global and static variables, constants
+readonly_statement_keywords = ("SELECT", "WITH", "VALUES")
+
+# Statements, which can change state of connection inherited by next client, like pragmas, attached databases or temporary tables
+connection_state_pattern = re.compile(r"\b(?:PRAGMA|ATTACH|DETACH|TEMP|TEMPORARY)\b", re.IGNORECASE)
+writing_opcodes = ("OpenWrite", "AutoCommit", "Vacuum", "VCreate", "VDestroy", "JournalMode", "ParseSchema")
+
+writing_actions = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+schema_actions = tuple(
+    getattr(sqlite3, name) for name in dir(sqlite3)
+    if name.startswith(("SQLITE_CREATE_", "SQLITE_DROP_")) or name in ["SQLITE_ALTER_TABLE", "SQLITE_ATTACH", "SQLITE_DETACH", "SQLITE_REINDEX"]
+)
+
+
+# ==------------------------------------------------------------== #
+# Exceptions                                                       #
+# ==------------------------------------------------------------== #
+class PoolTimeoutError(Exception):
+    """Raised when connection wasn't acquired from pool in time."""
+
+
+class QueryTimeoutError(aiosqlite.OperationalError):
+    """Raised when query was interrupted, because its execution deadline expired."""
+
+
+class BackupRestartsError(Exception):
+    """Raised when stepwise backup was restarted by writes too many times."""
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class TableAccess:
+    """SQLite authorizer collecting tables read and written by statements prepared on connection."""
+
+    def __init__(self) -> None:
+        """Creates empty tables sets."""
+
+        self.clear()
+
+    def __call__(self, action: int, argument1: str | None, argument2: str | None, database_name: str | None, trigger_name: str | None) -> int:
+        """Authorizer callback, records accessed table and allows any action."""
+
+        # Implicit transactions are begun by `sqlite3` even for statements taken from cache
+        if action in [sqlite3.SQLITE_TRANSACTION, sqlite3.SQLITE_SAVEPOINT]:
+            return sqlite3.SQLITE_OK
+
+        self.recorded = True
+
+        # If statement reads table column
+        if action == sqlite3.SQLITE_READ:
+            self.read.add(argument1)
+
+        # If statement modifies table rows
+        elif action in writing_actions:
+            self.written.add(argument1)
+
+        # If statement modifies database schema
+        elif action in schema_actions:
+            self.schema_changed = True
+
+        return sqlite3.SQLITE_OK
+
+    def clear(self) -> None:
+        """Forgets all of the recorded tables."""
+
+        self.recorded = False
+        self.read = set()
+        self.written = set()
+        self.schema_changed = False
+
+    def snapshot(self) -> tuple[frozenset[str], frozenset[str], bool]:
+        """Retrieves recorded read tables, written tables and schema modification flag."""
+
+        return frozenset(self.read), frozenset(self.written), self.schema_changed
+
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections with preregistered functions and pragmas.
+
+    In WAL mode pool holds one writer connection serializing mutating queries and scripts,
+    and `size` read-only connections serving SELECT queries in parallel.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        size: int,
+        acquire_timeout: float,
+        functions: list[callable],
+        wal: bool = False,
+        statement_cache_size: int = 128,
+        classification_cache_size: int = 1024,
+        query_timeout: float = 0.0,
+        progress_interval: int = 1000,
+        wait_histogram: Histogram | None = None,
+        write_lock: FileLock | None = None,
+        pragmas: dict[str, int | str] | None = None,
+        track_tables: bool = True,
+    ) -> None:
+        """Stores pool settings, connections are opened with `open` method."""
+
+        self.database_path = database_path
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.functions = functions
+        self.wal = wal
+        self.wait_histogram = wait_histogram
+
+        # Tuning pragmas applied to every connection, like `mmap_size` or `cache_size`
+        self.pragmas = pragmas or dict()
+
+        # Writers of all server processes are serialized by shared lock, so they don't contend for SQLite write lock
+        self.write_lock = write_lock
+
+        # Most recently used connections are reused first to keep their statement caches hot
+        self.writers = asyncio.LifoQueue()
+        self.readers = asyncio.LifoQueue() if wal else self.writers
+        self.opened = list()
+
+        self.classification_cache = collections.OrderedDict()
+        self.classification_cache_size = classification_cache_size
+
+        # Mirrors of connections LRU prepared statement caches to count hits and misses
+        self.statement_caches = dict()
+        self.statement_cache_size = statement_cache_size
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+
+        # Execution deadlines of connections, checked by SQLite progress handler every `progress_interval` instructions
+        self.query_timeout = query_timeout
+        self.progress_interval = progress_interval
+        self.deadlines = dict()
+        self.query_timeouts = 0
+
+        # Tables accessed by statements, authorizer isn't called for statements taken from cache
+        self.track_tables = track_tables
+        self.table_accesses = dict()
+        self.statement_tables = collections.OrderedDict()
+
+        # Connections, which state could be changed by executed statements, they are replaced on release
+        self.changed_connections = set()
+
+    async def connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        """Opens new database connection and prepares it to use."""
+
+        # Read-only connections are opened using URI to deny any writes
+        if readonly:
+            database = await aiosqlite.connect(f"file:{self.database_path}?mode=ro", uri=True, cached_statements=self.statement_cache_size, factory=sqlite_connection_factory(*self.functions))
+
+        else:
+            database = await aiosqlite.connect(self.database_path, cached_statements=self.statement_cache_size, factory=sqlite_connection_factory(*self.functions))
+
+            # Switching database to write-ahead log journal
+            if self.wal:
+                await database.execute("PRAGMA journal_mode = WAL;")
+
+        for name, value in self.pragmas.items():
+            await database.execute(f"PRAGMA {name} = {value};")
+
+        # Registarting SQL function
+        await registrate_sqlite_functions(database, *self.functions)
+
+        # Allowing to use foreign keys
+        await database.execute("PRAGMA foreign_keys = ON;")
+        await database.commit()
+
+        # Recording tables accessed by statements, if anything uses them
+        if self.track_tables:
+            self.table_accesses[database] = TableAccess()
+            await database.set_authorizer(self.table_accesses[database])
+
+        # Interrupting statements running past their deadline
+        if self.query_timeout:
+            self.deadlines[database] = None
+            await database.set_progress_handler(lambda: (deadline := self.deadlines.get(database)) is not None and time.monotonic() > deadline, self.progress_interval)
+
+        self.statement_caches[database] = collections.OrderedDict()
+        return database
+
+    async def open(self) -> None:
+        """Opens all of the pool connections."""
+
+        # Writer have to be opened first to create database file and switch journal mode
+        for _ in range(1 if self.wal else self.size):
+            self.opened.append(database := await self.connect())
+            self.writers.put_nowait(database)
+
+        # Opening read-only connections
+        for _ in range(self.size if self.wal else 0):
+            self.opened.append(database := await self.connect(readonly=True))
+            self.readers.put_nowait(database)
+
+    async def close(self) -> None:
+        """Closes all of the pool connections."""
+
+        for database in self.opened:
+            await database.close()
+
+        self.opened.clear()
+        self.statement_caches.clear()
+        self.table_accesses.clear()
+        self.deadlines.clear()
+        self.changed_connections.clear()
+        self.writers = asyncio.LifoQueue()
+        self.readers = asyncio.LifoQueue() if self.wal else self.writers
+
+    async def release(self, database: aiosqlite.Connection, readonly: bool = False) -> None:
+        """Returns connection to pool, replaces it if it can't be reset or its state could be changed by client."""
+
+        replaced = database in self.changed_connections
+
+        try:
+
+            # Rolling back transaction left by failed query
+            if database.in_transaction:
+                await database.rollback()
+
+        except aiosqlite.Error:
+            replaced = True
+
+        # Replacing broken connection or connection with changed pragmas, attached databases or temporary tables with a new one
+        if replaced:
+            self.opened.remove(database)
+            self.statement_caches.pop(database, None)
+            self.table_accesses.pop(database, None)
+            self.deadlines.pop(database, None)
+            self.changed_connections.discard(database)
+            await database.close()
+
+            self.opened.append(database := await self.connect(readonly and self.wal))
+
+        (self.readers if readonly else self.writers).put_nowait(database)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, readonly: bool = False) -> typing.AsyncIterator[tuple[aiosqlite.Connection, float]]:
+        """Acquires connection from pool, yields it with time spent waiting for it."""
+
+        start_time = time.perf_counter()
+
+        try:
+            database = await asyncio.wait_for((self.readers if readonly else self.writers).get(), self.acquire_timeout)
+
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError("No free database connection in `%s` sec(s)" % self.acquire_timeout)
+
+        # If writer have to wait for writers of another processes
+        if not readonly and self.write_lock is not None:
+
+            try:
+                locked = await self.write_lock.acquire(max(0.0, self.acquire_timeout - (time.perf_counter() - start_time)))
+
+            except asyncio.CancelledError:
+                self.writers.put_nowait(database)
+                raise
+
+            if not locked:
+                self.writers.put_nowait(database)
+                raise PoolTimeoutError("Write lock wasn't acquired in `%s` sec(s)" % self.acquire_timeout)
+
+        wait_time = time.perf_counter() - start_time
+
+        if self.wait_histogram is not None:
+            self.wait_histogram.observe(wait_time)
+
+        try:
+            yield database, wait_time
+
+        # Aborting statement still executed for cancelled request, so connection is returned to pool sooner
+        except asyncio.CancelledError:
+            await database.interrupt()
+            raise
+
+        finally:
+
+            try:
+
+                # Shielding release to not lose connection on cancelled request
+                await asyncio.shield(self.release(database, readonly))
+
+            finally:
+
+                if not readonly and self.write_lock is not None:
+                    self.write_lock.release()
+
+    @contextlib.contextmanager
+    def deadline(self, database: aiosqlite.Connection, timeout: float | None = None) -> typing.Iterator[None]:
+        """Interrupts statements executed on connection inside context after `timeout` or `query_timeout` seconds, converting interruption to `QueryTimeoutError`."""
+
+        # If deadlines are disabled
+        if not self.query_timeout or database not in self.deadlines:
+            yield
+            return
+
+        # Nested contexts keep deadline of the outer one
+        outer_deadline = self.deadlines[database]
+        self.deadlines[database] = deadline = outer_deadline or time.monotonic() + (timeout or self.query_timeout)
+
+        try:
+            yield
+
+        except aiosqlite.OperationalError as error:
+
+            # If statement was interrupted by progress handler
+            if str(error) == "interrupted" and time.monotonic() > deadline:
+                self.query_timeouts += 1
+                raise QueryTimeoutError("Query execution exceeded `%s` sec(s) limit" % (timeout or self.query_timeout)) from error
+
+            raise
+
+        finally:
+            self.deadlines[database] = outer_deadline
+
+    def execute(self, database: aiosqlite.Connection, query: str, params: list | dict = ()) -> typing.Any:
+        """Executes single SQL query on pool connection counting prepared statement cache hits and misses."""
+
+        statement_cache = self.statement_caches[database]
+
+        # If statement is already compiled and cached by connection
+        if query in statement_cache:
+            statement_cache.move_to_end(query)
+            self.statement_cache_hits += 1
+
+        else:
+            statement_cache[query] = None
+            self.statement_cache_misses += 1
+
+            if len(statement_cache) > self.statement_cache_size:
+                statement_cache.popitem(last=False)
+
+            # Cached statements were already checked, connection would have been replaced otherwise
+            self.check_connection_state(database, query)
+
+        self.clear_accessed_tables(database)
+        return database.execute(query, params)
+
+    async def executemany(self, database: aiosqlite.Connection, query: str, rows: list[list | dict]) -> None:
+        """Executes single SQL query for every row on pool connection."""
+
+        self.clear_accessed_tables(database)
+        self.check_connection_state(database, query)
+        await database.executemany(query, rows)
+
+    async def executescript(self, database: aiosqlite.Connection, script: str) -> None:
+        """Executes SQL script on pool connection."""
+
+        self.clear_accessed_tables(database)
+        self.check_connection_state(database, script)
+        await database.executescript(script)
+
+    def check_connection_state(self, database: aiosqlite.Connection, query: str) -> None:
+        """Marks connection to be replaced on release, if query can change its state inherited by next client."""
+
+        if connection_state_pattern.search(query):
+            self.changed_connections.add(database)
+
+    def clear_accessed_tables(self, database: aiosqlite.Connection) -> None:
+        """Forgets tables accessed by statements executed on connection, if they are recorded."""
+
+        if (table_access := self.table_accesses.get(database)) is not None:
+            table_access.clear()
+
+    def accessed_tables(self, database: aiosqlite.Connection, query: str | None = None) -> tuple[frozenset[str], frozenset[str], bool] | None:
+        """Retrieves tables read and written by statements executed on connection since last `execute` call, `None` if they are unknown.
+
+        Tables of single queries are remembered, because authorizer isn't called again for statements taken from cache.
+        """
+
+        # If tables aren't recorded
+        if (table_access := self.table_accesses.get(database)) is None:
+            return None
+
+        # If statements were prepared and authorized
+        if table_access.recorded:
+            tables = table_access.snapshot()
+
+            if query is not None:
+                self.statement_tables[query] = tables
+
+                if len(self.statement_tables) > self.classification_cache_size:
+                    self.statement_tables.popitem(last=False)
+
+            return tables
+
+        # If single query tables were remembered
+        if query is not None and (tables := self.statement_tables.get(query)) is not None:
+            self.statement_tables.move_to_end(query)
+            return tables
+
+    async def prewarm(self, tables: list[str] | None = None) -> list[str]:
+        """Reads b-trees of tables and their indexes by every idle connection to load their pages into caches. Retrieves names of read tables and indexes.
+
+        Has to be called before connections are used, for example on startup.
+        """
+
+        async with self.acquire(readonly=True) as (database, _):
+            async with database.execute("SELECT type, name, tbl_name FROM sqlite_master WHERE type IN ('table', 'index');") as cursor:
+                objects = [(object_type, name, table) for object_type, name, table in await cursor.fetchall() if not tables or table in tables]
+
+        # Counting rows walks through all pages of table or index b-tree
+        statements = [
+            (name, 'SELECT count(*) FROM "%s" %s;' % (table.replace('"', '""'), "NOT INDEXED" if object_type == "table" else 'INDEXED BY "%s"' % name.replace('"', '""')))
+            for object_type, name, table in objects
+        ]
+
+        async def read(database: aiosqlite.Connection) -> list[str]:
+            """Executes reading statements on connection, skipping objects which can't be read like virtual tables."""
+
+            read_objects = list()
+            for name, statement in statements:
+
+                try:
+
+                    async with database.execute(statement) as cursor:
+                        await cursor.fetchone()
+
+                    read_objects.append(name)
+
+                except aiosqlite.Error:
+                    continue
+
+            return read_objects
+
+        return (await asyncio.gather(*[read(database) for database in self.opened]))[0] if self.opened else list()
+
+    async def backup(self, target_path: str, pages: int, sleep: float, max_restarts: int = 3) -> None:
+        """Copies database into target file by SQLite online backup using separate connection, not occupying pool ones.
+
+        Stepwise copying restarted by writes more than `max_restarts` times is replaced by copying at once.
+        """
+
+        remaining_pages = None
+        restarts = 0
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            """Counts restarts of copying, they are recognized by increased count of remaining pages."""
+
+            nonlocal remaining_pages, restarts
+
+            if remaining_pages is not None and remaining > remaining_pages and (restarts := restarts + 1) > max_restarts:
+                raise BackupRestartsError("Backup was restarted by writes more than `%s` time(s)" % max_restarts)
+
+            remaining_pages = remaining
+
+        async with aiosqlite.connect(f"file:{self.database_path}?mode=ro", uri=True) as source, aiosqlite.connect(target_path) as target:
+
+            # WAL readers don't block writers, so database is copied from consistent snapshot at once
+            if self.wal or pages < 0:
+                return await source.backup(target, pages=-1)
+
+            # Otherwise it's copied by steps and writers can write between them, each write restarts copying
+            try:
+                await source.backup(target, pages=pages, sleep=sleep, progress=progress)
+
+            # Copying at once blocks writers until it's finished, but it's never restarted
+            except BackupRestartsError:
+                await source.backup(target, pages=-1)
+
+    def statement_cache_statistics(self) -> dict[str, int]:
+        """Retrieves prepared statement cache hits and misses counters."""
+
+        return {"size": self.statement_cache_size, "hits": self.statement_cache_hits, "misses": self.statement_cache_misses}
+
+    async def is_readonly(self, query: str, params: list | dict = ()) -> bool:
+        """Checks if single SQL query doesn't modify database and can be served by read-only connection."""
+
+        # If query is obviously mutating
+        if not query.lstrip(" \t\r\n(").upper().startswith(readonly_statement_keywords):
+            return False
+
+        # If query was already classified
+        if (readonly := self.classification_cache.get(query)) is not None:
+            self.classification_cache.move_to_end(query)
+            return readonly
+
+        # Classifying query by opcodes of its compiled program
+        async with self.acquire(readonly=True) as (database, _):
+
+            try:
+
+                async with database.execute("EXPLAIN " + query, params) as cursor:
+                    program = await cursor.fetchall()
+
+                readonly = not any(opcode in writing_opcodes or (opcode == "Transaction" and p2) for _, opcode, _, p2, *_ in program)
+
+            # Invalid queries are routed to writer to report error there
+            except aiosqlite.Error:
+                return False
+
+        self.classification_cache[query] = readonly
+        if len(self.classification_cache) > self.classification_cache_size:
+            self.classification_cache.popitem(last=False)
+
+        return readonly
@@ -0,0 +1,113 @@
+import gzip
+import json
+import typing
+import fastapi
+
+# Optional dependencies
+try:
+    import msgpack
+
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+
+except ImportError:
+    zstandard = None
+
+# Global and static variables, constants
+response_formats = ["json", "msgpack"]
+response_layouts = ["rows", "columns"]
+
+media_types = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def negotiate_format(request_format: str | None, accept: str) -> str:
+    """Chooses response format using request field or `Accept` header."""
+
+    # If format was requested explicitly
+    if request_format:
+        return request_format
+
+    return "msgpack" if "application/msgpack" in accept or "application/x-msgpack" in accept else "json"
+
+
+def negotiate_compression(accept_encoding: str) -> str | None:
+    """Chooses response compression using `Accept-Encoding` header, zstd is preferred."""
+
+    encodings = [item.split(";")[0].strip() for item in accept_encoding.lower().split(",")]
+
+    # If client accepts zstd and it's installed
+    if "zstd" in encodings and zstandard is not None:
+        return "zstd"
+
+    if "gzip" in encodings:
+        return "gzip"
+
+
+def to_columns(content: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """Converts result rows to column-oriented layout, every column is sent as one array."""
+
+    # If there is no result data
+    if not content.get("columns"):
+        return content
+
+    return content | {"data": [list(column) for column in zip(*content["data"])] if content["data"] else [list() for _ in content["columns"]]}
+
+
+def encode_json_value(value: typing.Any) -> typing.Any:
+    """Encodes values JSON doesn't support, BLOBs are encoded as `{"$blob": "<hex>"}` objects to keep any bytes."""
+
+    if isinstance(value, bytes):
+        return {"$blob": value.hex()}
+
+    raise TypeError("Object of type `%s` is not JSON serializable" % type(value).__name__)
+
+
+def encode_response(
+    content: dict[str, typing.Any],
+    response_format: str = "json",
+    layout: str = "rows",
+    compression: str | None = None,
+    compression_level: int = 3,
+    min_compression_size: int = 1024,
+) -> fastapi.Response:
+    """Encodes response content directly to bytes, skipping generic JSON encoder."""
+
+    # If data have to be sent column by column
+    if layout == "columns":
+        content = to_columns(content)
+
+    # MessagePack encodes text, numbers and BLOBs natively
+    if response_format == "msgpack":
+
+        if msgpack is None:
+            raise Exception("MessagePack format requires `msgpack` package to be installed")
+
+        payload = msgpack.packb(content, use_bin_type=True)
+
+    else:
+        payload = json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=encode_json_value).encode()
+
+    headers = dict()
+
+    # Compressing only payloads big enough to win on it
+    if compression and len(payload) >= min_compression_size:
+
+        if compression == "zstd":
+            payload = zstandard.ZstdCompressor(level=compression_level).compress(payload)
+
+        else:
+            payload = gzip.compress(payload, compresslevel=compression_level)
+
+        headers["Content-Encoding"] = compression
+        headers["Vary"] = "Accept-Encoding"
+
+    return fastapi.Response(payload, media_type=media_types[response_format], headers=headers)
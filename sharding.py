@@ -0,0 +1,159 @@
+import re
+import json
+import time
+import zlib
+import typing
+import asyncio
+
+# Local imports
+from pool import *
+
+# Global and static variables, constants
+order_pattern = re.compile(r"^\s*\"?([^\"]+?)\"?(?:\s+(ASC|DESC))?\s*$", re.IGNORECASE)
+inserting_pattern = re.compile(r"\)\s*(?:INSERT|REPLACE)\s+(?:OR\s+\w+\s+)?INTO\b", re.IGNORECASE)
+
+
+# ==------------------------------------------------------------== #
+# Exceptions                                                       #
+# ==------------------------------------------------------------== #
+class ShardingError(Exception):
+    """Raised when results of shards can't be merged as requested."""
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def shard_index(key: int | str, count: int) -> int:
+    """Retrieves shard of key by stable hash, which is the same in every process and after restart."""
+
+    return zlib.crc32(json.dumps(key).encode()) % count
+
+
+def adds_rows(query: str, single: bool = True) -> bool:
+    """Checks if query or any statement of script adds rows by `INSERT`, `REPLACE` or upsert, including ones after common table expressions."""
+
+    for statement in [query] if single else split_statements(query):
+        statement = statement.lstrip(" \t\r\n(").upper()
+
+        if statement.startswith(("INSERT", "REPLACE")) or (statement.startswith("WITH") and inserting_pattern.search(statement)):
+            return True
+
+    return False
+
+
+def sort_value(value: typing.Any) -> tuple[int, typing.Any]:
+    """Retrieves sort key of SQLite value, `NULL` values go first, then numbers, strings and blobs like in SQLite."""
+
+    if value is None:
+        return 0, 0
+
+    if isinstance(value, (int, float)):
+        return 1, value
+
+    return (2, value) if isinstance(value, str) else (3, value)
+
+
+def merge_rows(columns: list[str], results: list[list[tuple]], order_by: list[str] | None = None, limit: int | None = None) -> list[tuple]:
+    """Merges rows of shards ordering them by `column [ASC|DESC]` items and cutting them by limit."""
+
+    data = [row for rows in results for row in rows]
+
+    # Sorting by the least significant column first, sort is stable and merges already sorted rows of shards as runs
+    for item in reversed(order_by or list()):
+
+        if not (match := order_pattern.match(item)) or match.group(1) not in columns:
+            raise ShardingError("Unable to order results by `%s`, result has no such column" % item)
+
+        index = columns.index(match.group(1))
+        data.sort(key=lambda row: sort_value(row[index]), reverse=(match.group(2) or "").upper() == "DESC")
+
+    return data[:limit] if limit is not None else data
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class ShardedDatabase:
+    """Named database of one or several SQLite files, every file has its own connections pool and writer.
+
+    Queries with key are executed on one shard chosen by key hash, queries without key are executed on all shards at once.
+    """
+
+    def __init__(self, pools: list[ConnectionPool]) -> None:
+        """Stores pools of shards, their connections are opened with `open` method."""
+
+        self.pools = pools
+
+    async def open(self) -> None:
+        """Opens connections of all shards."""
+
+        for pool in self.pools:
+            await pool.open()
+
+    async def close(self) -> None:
+        """Closes connections of all shards."""
+
+        for pool in self.pools:
+            await pool.close()
+
+    async def execute_on_shard(self, pool: ConnectionPool, query: str, params: list | dict, single: bool) -> tuple[list[str] | None, list[tuple] | None, int]:
+        """Executes and commits query or script on one shard. Retrieves result columns, rows and count of modified rows."""
+
+        readonly = single and pool.wal and await pool.is_readonly(query, params)
+
+        async with pool.acquire(readonly) as (database, _):
+
+            # If executing SQL script
+            if not single:
+
+                with pool.deadline(database):
+                    await pool.executescript(database, query)
+                    await database.commit()
+
+                return None, None, 0
+
+            with pool.deadline(database):
+                async with pool.execute(database, query, params) as cursor:
+                    columns = [column[0] for column in cursor.description] if cursor.description else None
+                    data = await cursor.fetchall() if columns else None
+                    rowcount = max(0, cursor.rowcount)
+
+            await database.commit()
+
+        return columns, data, rowcount
+
+    async def execute(
+        self,
+        query: str,
+        params: list | dict = (),
+        single: bool = True,
+        key: int | str | None = None,
+        order_by: list[str] | None = None,
+        limit: int | None = None,
+    ) -> dict[str, typing.Any]:
+        """Executes query on shard of key or on all shards in parallel. Retrieves response content with merged results."""
+
+        pools = [self.pools[shard_index(key, len(self.pools))]] if key is not None else self.pools
+
+        start_time = time.perf_counter()
+        tasks = [asyncio.create_task(self.execute_on_shard(pool, query, params, single)) for pool in pools]
+
+        try:
+            results = await asyncio.gather(*tasks)
+
+        # Cancelling queries of another shards if one of them failed
+        except BaseException:
+
+            for task in tasks:
+                task.cancel()
+
+            raise
+
+        execution_time = f"{time.perf_counter() - start_time:.7f}"
+        content = {"status": "OK", "execution_time_secs": execution_time, "shards": len(pools)}
+
+        # If query doesn't retrieve rows
+        if (columns := next((columns for columns, _, _ in results if columns), None)) is None:
+            return content | ({"rowcount": sum(rowcount for _, _, rowcount in results)} if single else dict())
+
+        return content | {"columns": columns, "data": merge_rows(columns, [data for _, data, _ in results if data], order_by, limit)}
@@ -0,0 +1,189 @@
+import re
+import time
+import typing
+import asyncio
+import aiosqlite
+import collections
+
+# Local imports
+from misc import *
+
+# Global and static variables, constants
+scan_pattern = re.compile(r"^SCAN (\S+)(?: USING (?:COVERING )?INDEX \S+)?$")
+set_clause_pattern = re.compile(r"\bSET\b.*?(?=\bWHERE\b|$)", re.IGNORECASE | re.DOTALL)
+
+equality_operators = ("=", "==", "IS", "IN")
+comparison_operators_pattern = r"(==|=|<=|>=|<>|!=|<|>|IS\b|IN\b|BETWEEN\b|LIKE\b|GLOB\b)"
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def resolve_table(fingerprint: str, name: str, tables: dict[str, str]) -> str | None:
+    """Retrieves table name of scanned plan item, which can be table name or its alias in query."""
+
+    # If table is scanned by its name
+    if (table := tables.get(name.lower())) is not None:
+        return table
+
+    # Searching `table alias` or `table AS alias` in query
+    for match in re.finditer(r"\"?(\w+)\"?\s+(?:AS\s+)?\"?%s\"?(?!\w)" % re.escape(name), fingerprint, re.IGNORECASE):
+        if (table := tables.get(match.group(1).lower())) is not None:
+            return table
+
+
+def suggest_index(fingerprint: str, table: str, alias: str, columns: list[str]) -> str | None:
+    """Suggests index of scanned table on its columns compared in query, equality compared columns go first."""
+
+    # If table has no columns
+    if not columns:
+        return
+
+    qualifiers = "|".join(re.escape(name) for name in {table, alias})
+    pattern = re.compile(r"(?:(?<![\w.])(?:%s)\.|(?<![\w.]))\"?(%s)\"?\s*%s" % (qualifiers, "|".join(re.escape(column) for column in columns), comparison_operators_pattern), re.IGNORECASE)
+
+    equality_columns = list()
+    range_columns = list()
+
+    # Assignments of UPDATE statements are not comparisons
+    for match in pattern.finditer(set_clause_pattern.sub("", fingerprint)):
+        column = next(item for item in columns if item.lower() == match.group(1).lower())
+        target = equality_columns if match.group(2).upper() in equality_operators else range_columns
+
+        if column not in equality_columns and column not in range_columns:
+            target.append(column)
+
+    # Only the first range compared column can be used by index
+    if not (index_columns := equality_columns + range_columns[:1]):
+        return
+
+    return 'CREATE INDEX IF NOT EXISTS "%s_%s_index" ON "%s" (%s);' % (table, "_".join(index_columns), table, ", ".join('"%s"' % column for column in index_columns))
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class SlowQueryLog:
+    """Ring buffer of single queries executed longer than threshold with their query plans.
+
+    Plans are captured by `EXPLAIN QUERY PLAN` on separate read-only connection in background, not affecting pool connections.
+    """
+
+    def __init__(self, database_path: str, functions: list[callable], threshold: float, size: int, max_pending: int = 16, plans_cache_size: int = 1024) -> None:
+        """Stores slow queries log settings, side connection is opened with `open` method."""
+
+        self.database_path = database_path
+        self.functions = functions
+        self.threshold = threshold
+        self.max_pending = max_pending
+
+        self.entries = collections.deque(maxlen=size)
+        self.pending = set()
+        self.database = None
+
+        # Plans of already explained queries, they are valid until database schema is changed
+        self.plans = collections.OrderedDict()
+        self.plans_cache_size = plans_cache_size
+        self.schema_version = None
+
+    async def open(self) -> None:
+        """Opens side connection used to explain queries."""
+
+        # Cached `EXPLAIN` statements keep plans compiled for old schema
+        self.database = await aiosqlite.connect(f"file:{self.database_path}?mode=ro", uri=True, cached_statements=0, factory=sqlite_connection_factory(*self.functions))
+        await registrate_sqlite_functions(self.database, *self.functions)
+
+    async def close(self) -> None:
+        """Cancels pending explanations and closes side connection."""
+
+        for task in list(self.pending):
+            task.cancel()
+
+        if self.database is not None:
+            await self.database.close()
+            self.database = None
+
+    def observe(self, query: str, params: list | dict, duration: float) -> None:
+        """Records query, if it's executed longer than threshold, its plan is captured in background."""
+
+        # If query is fast enough
+        if duration < self.threshold:
+            return
+
+        entry = {"time": time.time(), "fingerprint": fingerprint_query(query), "duration": duration, "plan": None, "scans": None, "suggestions": None}
+        self.entries.append(entry)
+
+        # Skipping explanation if side connection is overloaded
+        if self.database is not None and len(self.pending) < self.max_pending:
+            self.pending.add(task := asyncio.create_task(self.explain(entry, query, params)))
+            task.add_done_callback(self.pending.discard)
+
+    async def explain(self, entry: dict[str, typing.Any], query: str, params: list | dict) -> None:
+        """Captures query plan, full table scans and indexes suggestions into log entry, plans are reused until database schema is changed."""
+
+        try:
+
+            # Reading schema table reloads schema changed by another connections, so plans use new indexes
+            async with self.database.execute("SELECT name FROM sqlite_master WHERE type = 'table';") as cursor:
+                tables = {name.lower(): name for name, in await cursor.fetchall()}
+
+            async with self.database.execute("PRAGMA schema_version;") as cursor:
+                schema_version = (await cursor.fetchone())[0]
+
+            # Plans captured before indexes were created or dropped are outdated
+            if schema_version != self.schema_version:
+                self.schema_version = schema_version
+                self.plans.clear()
+
+            # If query was already explained
+            if (result := self.plans.get(query)) is not None:
+                self.plans.move_to_end(query)
+                entry |= result
+                return
+
+            async with self.database.execute("EXPLAIN QUERY PLAN " + query, params) as cursor:
+                plan = [row[3] for row in await cursor.fetchall()]
+
+            scans = list()
+            suggestions = list()
+
+            # Collecting tables scanned without index
+            for step in plan:
+
+                if not (match := scan_pattern.match(step)) or (table := resolve_table(entry["fingerprint"], match.group(1), tables)) is None:
+                    continue
+
+                async with self.database.execute("SELECT name FROM pragma_table_info(?);", [table]) as cursor:
+                    columns = [name for name, in await cursor.fetchall()]
+
+                scans.append(table)
+                if (suggestion := suggest_index(entry["fingerprint"], table, match.group(1), columns)) and suggestion not in suggestions:
+                    suggestions.append(suggestion)
+
+        # Queries using temporary tables or invalid ones can't be explained
+        except aiosqlite.Error as error:
+            plan, scans, suggestions = ["Unable to explain query: %s" % error], list(), list()
+
+        entry |= (result := {"plan": plan, "scans": scans, "suggestions": suggestions})
+
+        self.plans[query] = result
+        if len(self.plans) > self.plans_cache_size:
+            self.plans.popitem(last=False)
+
+    def worst(self, count: int) -> list[dict[str, typing.Any]]:
+        """Retrieves logged queries fingerprints with the biggest total duration, their scans and indexes suggestions."""
+
+        groups = dict()
+        for entry in self.entries:
+
+            if (group := groups.get(entry["fingerprint"])) is None:
+                group = groups[entry["fingerprint"]] = {"fingerprint": entry["fingerprint"], "count": 0, "total_duration": 0.0, "max_duration": 0.0, "scans": list(), "suggestions": list()}
+
+            group["count"] += 1
+            group["total_duration"] += entry["duration"]
+            group["max_duration"] = max(group["max_duration"], entry["duration"])
+
+            for key in ["scans", "suggestions"]:
+                group[key].extend(item for item in entry[key] or list() if item not in group[key])
+
+        return sorted(groups.values(), key=lambda group: group["total_duration"], reverse=True)[:count]
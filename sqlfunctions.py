@@ -1,8 +1,14 @@
 import re
+import math
 import time
 import exrex
+import bisect
 import hashlib
 import datetime
+import functools
+
+# Local imports
+from misc import *
 
 # Global and static variables, constants
 time_format_map = {
@@ -15,40 +21,65 @@ time_format_map = {
     "y": 60 * 60 * 24 * 365
 }
 
+timestamp_format = r"%Y-%m-%d %H:%M:%S"
+
+
+# ==-----------------------------------------------------------------------------== #
+# Caches                                                                            #
+# ==-----------------------------------------------------------------------------== #
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Compiles regex pattern once for all rows of query."""
+
+    return re.compile(pattern)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_timestamp(timestamp: str) -> int:
+    """Parses time stamp into Unix-time once for all rows of query."""
+
+    return int(time.mktime(datetime.datetime.strptime(timestamp, timestamp_format).timetuple()))
+
 
 # ==-----------------------------------------------------------------------------== #
 # Cryptography and security                                                         #
 # ==-----------------------------------------------------------------------------== #
+@deterministic
 def md5(string: str) -> str:
     """Hashes string using md5 algorithm."""
 
     return hashlib.md5(string.encode()).hexdigest()
 
 
+@deterministic
 def sha1(string: str) -> str:
     """Hashes string using sha1 algorithm."""
 
     return hashlib.sha1(string.encode()).hexdigest()
 
 
+@deterministic
 def sha224(string: str) -> str:
     """Hashes string using sha224 algorithm."""
 
     return hashlib.sha224(string.encode()).hexdigest()
 
 
+@deterministic
 def sha256(string: str) -> str:
     """Hashes string using sha256 algorithm."""
 
     return hashlib.sha256(string.encode()).hexdigest()
 
 
+@deterministic
 def sha384(string: str) -> str:
     """Hashes string using sha384 algorithm."""
 
     return hashlib.sha384(string.encode()).hexdigest()
 
 
+@deterministic
 def sha512(string: str) -> str:
     """Hashes string using sha512 algorithm."""
 
@@ -60,30 +91,35 @@ def sha512(string: str) -> str:
 # ==-----------------------------------------------------------------------------== #
 # NOTE: This function is necessary to use `REGEXP` keyword in SQLite syntax
 # Looks like it's not built-in engine to process it... IDK ¯\_(ツ)_/¯
+@deterministic
 def regexp(pattern: str, string: str) -> bool:
     """Checks if string matches regex pattern"""
 
-    return re.match(pattern, string) is not None
+    return compile_pattern(pattern).match(string) is not None
 
 
+@deterministic
 def contains(string: str, substring: str) -> bool:
     """Checks if substring contains in string."""
 
     return substring in string
 
 
+@deterministic
 def startswith(string: str, substring: str) -> bool:
     """Checks if string starts with substring."""
 
     return string.startswith(substring)
 
 
+@deterministic
 def endswith(string: str, substring: str) -> bool:
     """Checks if string ends with substring."""
 
     return string.endswith(substring)
 
 
+@deterministic
 def substring(string: str, start: int, stop: int) -> None:
     """Retrieves substring from string using start and stop indexes."""
 
@@ -105,36 +141,42 @@ def random_regexp_string(pattern: str) -> str:
     return result
 
 
+@deterministic
 def reverse(string: str) -> None:
     """Reverses string."""
 
     return string[::-1]
 
 
+@deterministic
 def replace(string: str, old: str, new: str, times: int) -> str:
     """Replaces substring in string N times. Replaces all substrings if `times` is `-1`."""
 
     return string.replace(old, new, times)
 
 
+@deterministic
 def strip(string: str) -> str:
     """Deletes all escape and space chars from the end and start of the string."""
 
     return str(string).strip()
 
 
+@deterministic
 def to_lower(string: str) -> str:
     """Converts string to lowercase."""
 
     return string.lower()
 
 
+@deterministic
 def to_upper(string: str) -> str:
     """Converts string to uppercase."""
 
     return string.upper()
 
 
+@deterministic
 def to_capital(string: str) -> str:
     """Converts first char of the string to uppercase, another ones - to lowecase."""
 
@@ -153,19 +195,19 @@ def now_unix() -> int:
 def now_timestamp() -> str:
     """Retrieves current time stamp."""
 
-    return datetime.datetime.now().strftime(r"%Y-%m-%d %H:%M:%S")
+    return datetime.datetime.now().strftime(timestamp_format)
 
 
 def unix_from_timestamp(timestamp: str) -> int:
     """Converts times stamo to Unix-time."""
 
-    return int(time.mktime(datetime.datetime.strptime(timestamp, r"%Y-%m-%d %H:%M:%S").timetuple()))
+    return parse_timestamp(timestamp)
 
 
 def timestamp_from_unix(unix_time: int) -> str:
     """Converts Unix-time to time stamp."""
 
-    return datetime.datetime.fromtimestamp(unix_time).strftime(r"%Y-%m-%d %H:%M:%S")
+    return datetime.datetime.fromtimestamp(unix_time).strftime(timestamp_format)
 
 
 def after_unix(format_time_string: str) -> int:
@@ -198,26 +240,146 @@ def time_difference(stop_timestamp: str, start_timestamp: str) -> int:
     return unix_from_timestamp(stop_timestamp) - unix_from_timestamp(start_timestamp)
 
 
+# ==-----------------------------------------------------------------------------== #
+# Aggregate functions                                                               #
+# ==-----------------------------------------------------------------------------== #
+# NOTE: Aggregate classes with `inverse` and `value` methods can be used as window functions too
+class Variance:
+    """Retrieves sample variance of values."""
+
+    def __init__(self) -> None:
+        """Creates empty running mean and sum of squared deviations."""
+
+        self.count = 0
+        self.mean = 0.0
+        self.squares = 0.0
+
+    def step(self, value: float) -> None:
+        """Adds value, `NULL` values are skipped."""
+
+        if value is None:
+            return
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+
+    def inverse(self, value: float) -> None:
+        """Removes value leaving window frame."""
+
+        if value is None:
+            return
+
+        # If window frame became empty
+        if not (count := self.count - 1):
+            self.count, self.mean, self.squares = 0, 0.0, 0.0
+            return
+
+        self.count = count
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.squares -= delta * (value - self.mean)
+
+    def value(self) -> float | None:
+        """Retrieves variance of current values, `NULL` if there are less than two of them."""
+
+        return max(0.0, self.squares) / (self.count - 1) if self.count > 1 else None
+
+    def finalize(self) -> float | None:
+        """Retrieves variance of all values."""
+
+        return self.value()
+
+
+class StandardDeviation(Variance):
+    """Retrieves sample standard deviation of values."""
+
+    def value(self) -> float | None:
+        """Retrieves standard deviation of current values, `NULL` if there are less than two of them."""
+
+        return math.sqrt(variance) if (variance := super().value()) is not None else None
+
+
+class Percentile:
+    """Retrieves percentile of values with linear interpolation, `part` is between 0 and 1."""
+
+    def __init__(self) -> None:
+        """Creates empty sorted values list."""
+
+        self.values = list()
+        self.part = 0.5
+
+    def step(self, value: float, part: float) -> None:
+        """Adds value, `NULL` values are skipped."""
+
+        if value is None:
+            return
+
+        if not 0 <= part <= 1:
+            raise ValueError("Percentile part has to be between 0 and 1")
+
+        bisect.insort(self.values, value)
+        self.part = part
+
+    def inverse(self, value: float, part: float) -> None:
+        """Removes value leaving window frame."""
+
+        if value is not None:
+            del self.values[bisect.bisect_left(self.values, value)]
+
+    def value(self) -> float | None:
+        """Retrieves percentile of current values, `NULL` if there are no values."""
+
+        if not self.values:
+            return
+
+        position = (len(self.values) - 1) * self.part
+        lower = math.floor(position)
+        upper = min(lower + 1, len(self.values) - 1)
+
+        return self.values[lower] + (self.values[upper] - self.values[lower]) * (position - lower)
+
+    def finalize(self) -> float | None:
+        """Retrieves percentile of all values."""
+
+        return self.value()
+
+
+class Median(Percentile):
+    """Retrieves median of values."""
+
+    def step(self, value: float) -> None:
+        """Adds value, `NULL` values are skipped."""
+
+        super().step(value, 0.5)
+
+    def inverse(self, value: float) -> None:
+        """Removes value leaving window frame."""
+
+        super().inverse(value, 0.5)
+
+
 # ==-----------------------------------------------------------------------------== #
 # Reflection                                                                        #
 # ==-----------------------------------------------------------------------------== #
 def functions() -> str | None:
     """Retrieves list of registered SQL functions."""
 
-    return ", ".join([item.__name__.upper() for item in sql_functions]) if sql_functions else None
+    return ", ".join([sql_function_name(item) for item in sql_functions]) if sql_functions else None
 
 
 def function_documentation(function_name: str) -> str | None:
     """Retrieves function description if function with given name exists."""
 
-    result = [item.__doc__ for item in sql_functions if item.__name__.lower() == function_name.lower()]
+    result = [item.__doc__ for item in sql_functions if sql_function_name(item) == function_name.upper()]
     return result[0] if result else None
 
 
 def function_annotations(function_name: str) -> str | None:
     """Retrieves function types annotations if function with given name exists."""
 
-    if not (result := [item.__annotations__ for item in sql_functions if item.__name__.lower() == function_name.lower()]):
+    if not (result := [sql_function_annotations(item) for item in sql_functions if sql_function_name(item) == function_name.upper()]):
         return
 
     arguments = [f"{item[0]}{f'<{item[1].__name__}>' if hasattr(item[1], '__name__') else f'<{str(item[1])}>'}" for item in result[0].items() if item[0] != 'return']
@@ -226,6 +388,6 @@ def function_annotations(function_name: str) -> str | None:
     return f"({', '.join(arguments)}) -> {f'<{return_value.__name__}>' if hasattr(return_value, '__name__') else f'<{str(return_value)}>'}"
 
 
-# SQL function list
+# SQL function and aggregate classes list, imported and cached helpers aren't registered
 # NOTE: This line of code have to be placed at the end of the code
-sql_functions = [item for _, item in dict(globals()).items() if hasattr(item, "__code__")]
+sql_functions = [item for _, item in dict(globals()).items() if (hasattr(item, "__code__") or hasattr(item, "finalize")) and item.__module__ == __name__]
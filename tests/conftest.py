@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+
+import pytest
+
+# Global and static variables, constants
+repository_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, repository_path)
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Runs service with default config on empty database in temporary directory. Yields its address."""
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    with open(os.path.join(repository_path, "config.toml"), "r") as file:
+        (tmp_path / "config.toml").write_text(file.read().replace("port = 7500", "port = %s" % port))
+
+    (tmp_path / "startup.sql").write_text("CREATE TABLE IF NOT EXISTS Items (value);")
+
+    process = subprocess.Popen([sys.executable, os.path.join(repository_path, "main.py")], cwd=tmp_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+
+        # Waiting until service accepts connections
+        deadline = time.monotonic() + 15
+        while True:
+
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+
+            except OSError:
+
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("Service wasn't started")
+
+                time.sleep(0.1)
+
+        yield "127.0.0.1:%s" % port
+
+    finally:
+        process.terminate()
+        process.wait(10)
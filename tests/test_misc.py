@@ -0,0 +1,23 @@
+import asyncio
+
+from misc import *
+
+
+async def stream(content: bytes, size: int = 4) -> typing.AsyncIterator[bytes]:
+    """Yields content by small chunks, like request body is received."""
+
+    for index in range(0, len(content), size):
+        yield content[index:index + size]
+
+
+async def collect(rows: typing.AsyncIterator) -> list:
+    """Retrieves all of the async iterator items."""
+
+    return [row async for row in rows]
+
+
+def test_csv_quoted_field_with_line_breaks():
+    """Quoted CSV field containing line breaks is parsed as one field of one record."""
+
+    assert asyncio.run(collect(read_csv_rows(stream(b'1,"line one\nline two"\n2,x\n')))) == [["1", "line one\nline two"], ["2", "x"]]
+    assert asyncio.run(collect(read_csv_rows(stream(b'id,text\r\n1,"a\r\n\r\nb ""quoted"""\r\n'), header=True))) == [{"id": "1", "text": 'a\n\nb "quoted"'}]
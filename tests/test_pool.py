@@ -0,0 +1,28 @@
+import asyncio
+
+from pool import *
+
+
+async def connection_state(database_path: str) -> tuple[int, int]:
+    """Changes state of pooled connection and retrieves state seen by next client of the same connection."""
+
+    pool = ConnectionPool(database_path, 1, 5.0, [])
+    await pool.open()
+
+    try:
+
+        async with pool.acquire() as (database, _):
+            await pool.executescript(database, "PRAGMA foreign_keys = OFF; CREATE TEMP TABLE Scratch (value);")
+
+        async with pool.acquire() as (database, _):
+            async with pool.execute(database, "SELECT foreign_keys, (SELECT count(*) FROM sqlite_temp_master) FROM pragma_foreign_keys;") as cursor:
+                return await cursor.fetchone()
+
+    finally:
+        await pool.close()
+
+
+def test_connection_state_is_not_inherited(tmp_path):
+    """Pragmas and temporary tables of one client don't leak to next client of pooled connection."""
+
+    assert asyncio.run(connection_state(str(tmp_path / "database.db"))) == (1, 0)
@@ -0,0 +1,23 @@
+import json
+
+from websockets.sync.client import connect
+
+
+def test_script_in_session_transaction_is_rolled_back(server):
+    """Script executed inside session transaction doesn't commit it."""
+
+    with connect("ws://%s/database/ws" % server) as websocket:
+
+        for message in [
+            {"id": 1, "action": "begin"},
+            {"id": 2, "query": "INSERT INTO Items VALUES (1);", "single": True},
+            {"id": 3, "query": "INSERT INTO Items VALUES (2); INSERT INTO Items VALUES (';');", "single": False},
+            {"id": 4, "action": "rollback"},
+            {"id": 5, "query": "SELECT count(*) FROM Items;", "single": True},
+        ]:
+            websocket.send(json.dumps(message))
+            response = json.loads(websocket.recv(5))
+
+            assert response["id"] == message["id"] and response["status"] == "OK", response
+
+    assert response["data"] == [[0]]
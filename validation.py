@@ -2,8 +2,9 @@ import re
 import typing
 import asyncio
 
-# Local imports
-from misc import *
+# Global and static variables, constants
+number_types = (int, float)
+matching_any_patterns = ["(.*)", ".*"]
 
 
 # ==------------------------------------------------------------== #
@@ -45,11 +46,157 @@ def validate_range(value: int | float, min_value: int | float = None, max_value:
         return "have to be less than `%s`" % f"{max_value:_}"
 
 
+def compile_string_check(pattern: str, min_length: int = None, max_length: int = None) -> typing.Callable[[str], str | None]:
+    """Compiles string size and regexp pattern limitations into check with the same messages as `validate_string`."""
+
+    # Patterns matching any string are not executed at all
+    compiled_pattern = None if pattern in matching_any_patterns else re.compile(pattern)
+    pattern_error = "doesn't matches `%s` limitation pattern" % pattern.replace("\\", r"\\", -1)
+
+    exact_length = min_length if min_length and max_length and min_length == max_length else None
+    exact_length_error = "have to be `%s` char(s)" % min_length
+    min_length_error = "too short, have to be at least `%s` char(s)" % min_length
+    max_length_error = "too long, have be at most `%s` char(s)" % max_length
+
+    def check(string: str) -> str | None:
+        """Checks if string have valid size and regexp pattern."""
+
+        # If string size is invalid
+        if exact_length is not None and len(string) != exact_length:
+            return exact_length_error
+
+        # If string size less allowed
+        if min_length and len(string) < min_length:
+            return min_length_error
+
+        # If string size greater allowed
+        if max_length and len(string) > max_length:
+            return max_length_error
+
+        # If string doesn't matches regexp pattern
+        if compiled_pattern is not None and not compiled_pattern.match(string):
+            return pattern_error
+
+    return check
+
+
+def compile_range_check(min_value: int | float = None, max_value: int | float = None) -> typing.Callable[[int | float], str | None]:
+    """Compiles number range limitations into check with the same messages as `validate_range`."""
+
+    range_error = "have to be in range from `%s` to `%s` inclusive" % (f"{min_value:_}", f"{max_value:_}") if min_value is not None and max_value is not None else None
+    min_value_error = "have to be greater than `%s`" % f"{min_value:_}" if min_value is not None else None
+    max_value_error = "have to be less than `%s`" % f"{max_value:_}" if max_value is not None else None
+
+    def check(value: int | float) -> str | None:
+        """Checks if number are in valid ranges."""
+
+        # If number are not in valid ranges
+        if range_error is not None and not min_value <= value <= max_value:
+            return range_error
+
+        # If number less than allowed
+        if min_value is not None and value < min_value:
+            return min_value_error
+
+        # If number greater than allowed
+        if max_value is not None and value > max_value:
+            return max_value_error
+
+    return check
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class ParamsSchema:
+    """Request params limitations compiled once, validates params synchronously with the same messages as `validate_params`.
+
+    Limitations have the same format as `validate_params` ones, regexp patterns, enumerations and messages are prepared on creation.
+    """
+
+    def __init__(self, required_params: list[str], params_limitations: list[tuple[tuple | None, list | None, type | tuple[type, ...]]], optional_params: list[str] | None = None) -> None:
+        """Compiles params limitations."""
+
+        self.required_params = list(required_params)
+        self.params_limitations = list(params_limitations)
+        self.optional_params = list(optional_params or list())
+
+        self.checks = list()
+        for required_param, (limitation, enumeration, types) in zip(self.required_params, self.params_limitations):
+
+            # Checks applied to strings and numbers depend on limitation format
+            string_check = compile_string_check(*limitation) if limitation and not enumeration and isinstance(limitation[0], str) else None
+            range_check = compile_range_check(*limitation) if limitation and not enumeration and not isinstance(limitation[0], str) else None
+
+            self.checks.append((
+                required_param,
+                required_param in self.optional_params,
+                types,
+                "Param `%s` required but not received" % required_param,
+                "Param `%s` have to be `%s` type" % (required_param, "` or `".join([item.__name__ for item in types]) if isinstance(types, tuple) else types.__name__),
+                tuple(enumeration) if enumeration else None,
+                "Param `%s` can only have one of the values: %s" % (required_param, ", ".join([f"'{item}'" for item in enumeration])) if enumeration else None,
+                string_check,
+                range_check,
+                "Param `%s` %%s" % required_param,
+            ))
+
+    def without(self, *params: str) -> "ParamsSchema":
+        """Creates schema without given params, for example without password when it's not required."""
+
+        limitations = [(param, limitation) for param, limitation in zip(self.required_params, self.params_limitations) if param not in params]
+        return ParamsSchema([param for param, _ in limitations], [limitation for _, limitation in limitations], [param for param in self.optional_params if param not in params])
+
+    def validate(self, params: dict[str, typing.Any]) -> list[str]:
+        """Checks if all required params were received and validates them. Optional params are validated only if received."""
+
+        missing_params = list()
+        invalid_params = list()
+
+        for required_param, optional, types, missing_error, type_error, enumeration, enumeration_error, string_check, range_check, param_error in self.checks:
+
+            # If param was not received
+            if required_param not in params:
+
+                if not optional:
+                    missing_params.append(missing_error)
+
+                continue
+
+            # If params type is invalid
+            if not isinstance(param := params[required_param], types):
+                invalid_params.append(type_error)
+                continue
+
+            # If param are not in enumeration of allowed params
+            if enumeration is not None:
+
+                if param not in enumeration:
+                    invalid_params.append(enumeration_error)
+
+                continue
+
+            # Validating number by range
+            if type(param) in number_types:
+
+                if range_check is not None and (range_error := range_check(param)):
+                    invalid_params.append(param_error % range_error)
+
+            # Validating string by length and regexp pattern
+            elif string_check is not None and (match_error := string_check(param)):
+                invalid_params.append(param_error % match_error)
+
+        return [*missing_params, *invalid_params]
+
+
 # ==------------------------------------------------------------== #
 # Async functions                                                  #
 # ==------------------------------------------------------------== #
-async def validate_params(params: dict[str, typing.Any], required_params: list[str], params_limitations: list[tuple[tuple | None, list | None, type]]) -> list[str]:
-    """Checks if all required params were received and validates them."""
+async def validate_params(params: dict[str, typing.Any], required_params: list[str], params_limitations: list[tuple[tuple | None, list | None, type | tuple[type, ...]]], optional_params: list[str] | None = None) -> list[str]:
+    """Checks if all required params were received and validates them. Params from `optional_params` are validated only if received.
+
+    Routes validate params by precompiled `ParamsSchema`, this function is kept only as baseline of `benchmarks/validation.py`.
+    """
 
     missing_params = list()
     invalid_params = list()
@@ -57,6 +204,10 @@ async def validate_params(params: dict[str, typing.Any], required_params: list[s
     # Params validation
     for required_param, param_limitation in zip(required_params, params_limitations):
 
+        # If optional param was not received
+        if optional_params and required_param in optional_params and required_param not in params:
+            continue
+
         # Если обязательный параметр не был получен
         if required_param not in params:
             missing_params.append("Param `%s` required but not received" % required_param)
@@ -68,7 +219,7 @@ async def validate_params(params: dict[str, typing.Any], required_params: list[s
 
             # If params type is invalid
             if not isinstance(params[required_param], param_limitation[2]):
-                invalid_params.append("Param `%s` have to be `%s` type" % (required_param, param_limitation[2].__name__))
+                invalid_params.append("Param `%s` have to be `%s` type" % (required_param, "` or `".join([item.__name__ for item in param_limitation[2]]) if isinstance(param_limitation[2], tuple) else param_limitation[2].__name__))
 
                 await asyncio.sleep(0)
                 continue
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import typing
+import asyncio
+
+# Optional dependencies
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None
+
+# Global and static variables, constants
+worker_environment_variable = "DATABASE_SERVICE_WORKER"
+metrics_directory_environment_variable = "DATABASE_SERVICE_METRICS_DIRECTORY"
+
+
+# ==------------------------------------------------------------== #
+# Functions                                                        #
+# ==------------------------------------------------------------== #
+def write_worker_snapshot(directory: str, snapshot: dict[str, typing.Any]) -> None:
+    """Atomically replaces metrics snapshot file of current worker process."""
+
+    path = os.path.join(directory, "%s.json" % os.getpid())
+
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(snapshot, file)
+
+    os.replace(path + ".tmp", path)
+
+
+def read_worker_snapshots(directory: str) -> list[dict[str, typing.Any]]:
+    """Retrieves metrics snapshots of all worker processes except the current one."""
+
+    snapshots = list()
+    for name in os.listdir(directory):
+
+        # Skipping current worker and not finished files
+        if not name.endswith(".json") or name == "%s.json" % os.getpid():
+            continue
+
+        try:
+
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as file:
+                snapshots.append(json.load(file))
+
+        except (OSError, ValueError):
+            continue
+
+    return snapshots
+
+
+def remove_worker_snapshot(directory: str) -> None:
+    """Removes metrics snapshot file of current worker process."""
+
+    try:
+        os.remove(os.path.join(directory, "%s.json" % os.getpid()))
+
+    except OSError:
+        pass
+
+
+# ==------------------------------------------------------------== #
+# Classes                                                          #
+# ==------------------------------------------------------------== #
+class FileLock:
+    """Exclusive lock shared by processes through `flock` on lock file.
+
+    Lock is polled without blocking, so waiting for it can be cancelled or timed out like any coroutine.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.0005, max_poll_interval: float = 0.005) -> None:
+        """Stores lock settings, lock file is opened on first acquisition in every process."""
+
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.descriptor = None
+
+    async def acquire(self, timeout: float) -> bool:
+        """Waits for lock up to `timeout` seconds. Retrieves `False` if lock wasn't acquired in time."""
+
+        if self.descriptor is None:
+            self.descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        deadline = time.monotonic() + timeout
+        poll_interval = self.poll_interval
+
+        while True:
+
+            try:
+                fcntl.flock(self.descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+
+            except BlockingIOError:
+
+                if time.monotonic() >= deadline:
+                    return False
+
+            # Polling less often while lock is held for long
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, self.max_poll_interval)
+
+    def release(self) -> None:
+        """Releases lock."""
+
+        fcntl.flock(self.descriptor, fcntl.LOCK_UN)